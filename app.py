@@ -1,11 +1,35 @@
 import os
+import hmac
+import time
 import calendar
+import hashlib
+import click
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, make_response, g
+from flask import before_render_template, template_rendered
 import storage
+import backends
+import metrics
+import profiler
+
+# Tempo e número de chamadas de cada função de storage (ver /metrics)
+metrics.instrument_storage(storage)
+# Header Server-Timing em toda resposta (desligado com SERVER_TIMING=0) e perfil
+# de uma requisição pedido pelo admin (PROFILER_ENABLED=1 ou PROFILER_TOKEN definido)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") != "0"
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN")
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED") == "1" or bool(PROFILER_TOKEN)
+# O Server-Timing só soma os comandos SQL da requisição (backends.statement_totals,
+# cerca de 3 µs por comando); o perfil guarda cada comando com a função que o
+# executou (backends.record_statement, cerca de 10 µs). Registrado antes de
+# qualquer conexão ser aberta
+if SERVER_TIMING:
+    backends.count_statements = True
+if PROFILER_ENABLED:
+    backends.statement_observers.append(backends.record_statement)
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY") or "dev_secret"
@@ -44,6 +68,115 @@ def add_security_headers(response):
     response.headers['Content-Security-Policy'] = csp
     return response
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.template_seconds = 0.0
+    if SERVER_TIMING:
+        # Número e tempo dos comandos SQL desta requisição
+        g.sql_totals = backends.StatementTotals()
+        g.sql_totals_token = backends.statement_totals.set(g.sql_totals)
+
+@app.teardown_request
+def stop_statement_recorder(exc):
+    token = g.pop("sql_totals_token", None)
+    if token is not None:
+        backends.statement_totals.reset(token)
+    token = g.pop("sql_recorder_token", None)
+    if token is not None:
+        backends.statement_recorder.reset(token)
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    started = g.get("template_started")
+    if started is not None:
+        g.template_seconds = g.get("template_seconds", 0.0) + time.perf_counter() - started
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is not None:
+        # Rota como registrada (/horarios/<int:dia>), não a URL, para não criar uma série por dia
+        route = request.url_rule.rule if request.url_rule else "<sem rota>"
+        metrics.observe_request(request.method, route, response.status_code, time.perf_counter() - started)
+        metrics.set_cache_stats(storage.cache_stats())
+    return response
+
+@app.after_request
+def add_server_timing(response):
+    # Divisão do tempo da requisição, visível no DevTools (aba Network > Timing):
+    # SQL (tempo e número de comandos), templates e o resto do Python
+    started = g.get("request_started")
+    if not SERVER_TIMING or started is None:
+        return response
+    total = time.perf_counter() - started
+    totals = g.sql_totals
+    db = totals.seconds
+    tpl = g.template_seconds
+    rest = max(total - db - tpl, 0.0)
+    response.headers["Server-Timing"] = (
+        f'db;dur={db * 1000:.2f};desc="SQL ({totals.count} comandos)", '
+        f'tpl;dur={tpl * 1000:.2f};desc="Templates", '
+        f'app;dur={rest * 1000:.2f};desc="Python", '
+        f'total;dur={total * 1000:.2f}'
+    )
+    return response
+
+# === Perfil de uma requisição ===
+# Com o admin logado, ?_profile=1 ou o header "X-Profile: 1" devolvem, no lugar
+# da página, um .zip com o cProfile e os comandos SQL da requisição (profiler.py).
+# Com PROFILER_TOKEN definido, "X-Profile: <token>" funciona em qualquer sessão,
+# para medir telas que o admin não abre (ex.: /painel_barbeiro de um barbeiro).
+# Desligado sem PROFILER_ENABLED=1 ou PROFILER_TOKEN (ver o início do arquivo).
+
+def profiling_requested():
+    if not PROFILER_ENABLED:
+        return False
+    header = request.headers.get("X-Profile")
+    # Compara bytes: compare_digest recusa str com caracteres fora do ASCII
+    if header and PROFILER_TOKEN and hmac.compare_digest(header.encode(), PROFILER_TOKEN.encode()):
+        return True
+    return bool(header or request.args.get("_profile")) and session.get("role") == "admin"
+
+@app.before_request
+def start_profiler():
+    if profiling_requested():
+        # Comandos SQL desta requisição, um a um
+        statements = []
+        g.sql_recorder_token = backends.statement_recorder.set(statements)
+        g.profile = profiler.RequestProfile(statements)
+        g.profile.start()
+
+@app.after_request
+def send_profile(response):
+    profile = g.get("profile")
+    if profile is None:
+        return response
+    profile.stop()
+    route = request.url_rule.rule if request.url_rule else "<sem rota>"
+    data = profile.to_zip(request.method, request.full_path.rstrip("?"), route, response.status)
+    filename = f"perfil-{request.endpoint or 'sem-rota'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip"
+    resp = app.response_class(data, mimetype="application/zip")
+    resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+@app.teardown_request
+def stop_profiler(exc):
+    # Resposta que falhou antes do after_request
+    profile = g.get("profile")
+    if profile is not None:
+        profile.stop()
+
+@app.teardown_appcontext
+def release_db_conn(exc):
+    # Devolve a conexão da thread ao pool (desfaz qualquer transação pendente)
+    storage.release_conn()
+
 storage.init_db()
 
 # Helper para data/hora local (Brasil - UTC-3)
@@ -53,6 +186,60 @@ def get_local_now():
     br_offset = timezone(timedelta(hours=-3))
     return utc_now.astimezone(br_offset)
 
+def get_local_now_minute():
+    now = get_local_now()
+    return now.hour * 60 + now.minute
+
+# === ETags das telas de calendário ===
+# O ETag combina a versão do mês do barbeiro (storage.get_calendar_version,
+# incrementada por qualquer escrita em bookings/availability), o relógio e o
+# que mais a resposta usa. Se o navegador já tem a mesma versão recebe 304
+# sem que os horários sejam recalculados.
+
+def _render_version():
+    # Muda a cada deploy de templates/estáticos, invalidando ETags antigos
+    if os.getenv("APP_VERSION"):
+        return os.getenv("APP_VERSION")
+    latest = 0
+    for folder in (app.template_folder, app.static_folder):
+        for root, _dirs, files in os.walk(os.path.join(app.root_path, folder)):
+            for name in files:
+                latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+    return str(int(latest))
+
+RENDER_VERSION = _render_version()
+
+def make_etag(*parts):
+    raw = "|".join(str(p) for p in (RENDER_VERSION,) + parts)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def clock_etag_part(year, month, day=None):
+    # Horários de hoje que já passaram somem da tela: no dia (ou mês) atual o
+    # ETag muda a cada minuto; nos demais, a cada dia.
+    now = get_local_now()
+    if (now.year, now.month) == (year, month) and day in (None, now.day):
+        return now.strftime("%Y-%m-%d %H:%M")
+    return now.strftime("%Y-%m-%d")
+
+def session_etag_parts():
+    # Campos da sessão usados por base.html e pelas telas de calendário
+    return tuple(session.get(k) for k in ("usuario", "role", "barbershop_nome", "barbershop_phone", "barbershop_slug"))
+
+def not_modified(etag):
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+    return None
+
+def with_etag(body, etag):
+    resp = make_response(body)
+    resp.set_etag(etag)
+    # private: depende da sessão; no-cache: o navegador revalida sempre (If-None-Match)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
 @app.route("/")
 def home():
     # Se estiver logado, redireciona conforme o papel
@@ -104,14 +291,11 @@ def login():
             if user["role"] == "admin":
                 return redirect(url_for("admin_dashboard"))
 
-            # Carrega a barbearia do usuário na sessão
-            u_full = storage.get_user_by_id(user["id"])
-            if u_full and u_full["barbershop_id"]:
-                shop = storage.get_barbershop(u_full["barbershop_id"])
-                if shop:
-                    session["barbershop_id"] = shop["id"]
-                    session["barbershop_nome"] = shop["name"]
-                    session["barbershop_slug"] = shop["slug"]
+            # Carrega a barbearia do usuário na sessão (já vem junto com o usuário)
+            if user["barbershop_id"] and user["barbershop_slug"]:
+                session["barbershop_id"] = user["barbershop_id"]
+                session["barbershop_nome"] = user["barbershop_name"]
+                session["barbershop_slug"] = user["barbershop_slug"]
             
             if user["role"] == "barbeiro":
                 return redirect(url_for("painel_barbeiro"))
@@ -132,7 +316,8 @@ MESES = [
     "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"
 ]
 
-def build_dias_from_db(year=None, month=None, barber_id=None, barbershop_id=None):
+def build_dias_from_db(year=None, month=None, barber_id=None, barbershop_id=None, month_slots=None):
+    # month_slots: resultado de get_month_availability já buscado pela view
     if year is None or month is None:
         now = get_local_now()
         year = now.year
@@ -149,6 +334,8 @@ def build_dias_from_db(year=None, month=None, barber_id=None, barbershop_id=None
         dias.append({"tipo": "vazio"})
         
     today = get_local_now().date()
+    if month_slots is None:
+        month_slots = storage.get_month_availability(year, month, barber_id=barber_id, barbershop_id=barbershop_id)
     
     for d in range(1, num_days + 1):
         current_date = datetime(year, month, d).date()
@@ -160,13 +347,13 @@ def build_dias_from_db(year=None, month=None, barber_id=None, barbershop_id=None
         if is_sunday:
             disponivel = False
         else:
-            slots = storage.get_availability(d, year=year, month=month, barber_id=barber_id, barbershop_id=barbershop_id)
+            slots = month_slots[d]
             
             # Filtrar horários passados se for o dia atual
             if not is_past and current_date == today:
-                now_time = get_local_now().strftime("%H:%M")
+                now_minute = get_local_now_minute()
                 # Disponível apenas se houver slot ativo, não tomado E futuro
-                disponivel = any(s.get("available", True) and s["time"] > now_time for s in slots)
+                disponivel = any(s.get("available", True) and s["minute"] > now_minute for s in slots)
             else:
                 disponivel = any(s.get("available", True) for s in slots)
 
@@ -197,8 +384,9 @@ def agenda():
     if not barbershop_id:
         return redirect(url_for("home"))
 
-    # Buscar dados da barbearia para pegar o telefone
+    # Barbearia (telefone) e usuários (barbeiro padrão)
     shop = storage.get_barbershop(barbershop_id)
+    users = storage.get_users_by_barbershop(barbershop_id)
     barbershop_phone = shop["phone"] if shop else None
 
     barber_id = None # Opcional: filtrar por barbeiro específico se houver seleção
@@ -206,7 +394,6 @@ def agenda():
     # Se não houver barbeiro selecionado explicitamente, tentar pegar o primeiro barbeiro da loja
     # Isso garante que a agenda mostre slots de algum barbeiro (já que agora usamos slots por barbeiro)
     if not request.args.get("barber_id") and barbershop_id:
-        users = storage.get_users_by_barbershop(barbershop_id)
         barbers = [u for u in users if u["role"] == "barbeiro"]
         if barbers:
             barber_id = barbers[0]["id"]
@@ -231,8 +418,22 @@ def agenda():
             mes = None
             ano = None
 
-    dados_cal = build_dias_from_db(year=ano, month=mes, barber_id=barber_id, barbershop_id=barbershop_id)
-    return render_template("agenda.html", **dados_cal, barber_id=barber_id, barbearia_nome=barbearia_nome, barbershop_phone=barbershop_phone)
+    if ano is None or mes is None:
+        now = get_local_now()
+        ano, mes = now.year, now.month
+
+    etag = make_etag(
+        "agenda", barbershop_id, barber_id, ano, mes,
+        storage.get_calendar_version(ano, mes, barber_id=barber_id, barbershop_id=barbershop_id),
+        barbearia_nome, barbershop_phone, session_etag_parts(), clock_etag_part(ano, mes)
+    )
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    month_slots = storage.get_month_availability(ano, mes, barber_id=barber_id, barbershop_id=barbershop_id)
+    dados_cal = build_dias_from_db(year=ano, month=mes, barber_id=barber_id, barbershop_id=barbershop_id, month_slots=month_slots)
+    return with_etag(render_template("agenda.html", **dados_cal, barber_id=barber_id, barbearia_nome=barbearia_nome, barbershop_phone=barbershop_phone), etag)
 
 @app.route("/horarios/<int:dia>")
 def horarios(dia):
@@ -250,6 +451,17 @@ def horarios(dia):
     if not barbershop_id:
         return jsonify({"error": "no_shop_selected"}), 400
 
+    etag = None
+    if ano and mes:
+        etag = make_etag(
+            "horarios", barbershop_id, barber_id, ano, mes, dia,
+            storage.get_calendar_version(ano, mes, barber_id=barber_id, barbershop_id=barbershop_id),
+            clock_etag_part(ano, mes, dia)
+        )
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
     slots = storage.get_availability(dia, year=ano, month=mes, barber_id=barber_id, barbershop_id=barbershop_id)
     
     # Filtrar horários passados se for hoje
@@ -257,8 +469,8 @@ def horarios(dia):
         current_date = datetime(ano, mes, dia).date()
         today = get_local_now().date()
         if current_date == today:
-            now_time = get_local_now().strftime("%H:%M")
-            horarios_disponiveis = [s["time"] for s in slots if s.get("available", True) and s["time"] > now_time]
+            now_minute = get_local_now_minute()
+            horarios_disponiveis = [s["time"] for s in slots if s.get("available", True) and s["minute"] > now_minute]
         elif current_date < today:
              horarios_disponiveis = [] # Dia passado não tem horários
         else:
@@ -266,7 +478,8 @@ def horarios(dia):
     except ValueError:
         horarios_disponiveis = []
 
-    return jsonify({"dia": dia, "horarios": horarios_disponiveis, "detalhes": slots})
+    resp = jsonify({"dia": dia, "horarios": horarios_disponiveis, "detalhes": slots})
+    return with_etag(resp, etag) if etag else resp
 
 @app.route("/reservar", methods=["POST"])
 def reservar():
@@ -317,18 +530,30 @@ def reservar():
     if not service:
         service = "corte de cabelo"
 
-    # Processamento de múltiplos serviços
+    # Pega ID do barbeiro da requisição
+    barber_id = request.form.get("barber_id") or (request.json and request.json.get("barber_id"))
+    customer_name = request.form.get("customer_name") or (request.json and request.json.get("customer_name"))
+    
+    try:
+        if barber_id:
+            barber_id = int(barber_id)
+    except:
+        barber_id = None
+
+    # Processamento de múltiplos serviços: valida e soma a seleção inteira de uma vez
     service_ids = request.form.getlist("service_ids") or (request.json and request.json.get("service_ids"))
     total_price_cents = 0
+    selected_services = []
     
     if service_ids:
-        for sid in service_ids:
-            try:
-                s_info = storage.get_service_by_id(int(sid), barbershop_id=barbershop_id)
-                if s_info:
-                    total_price_cents += (s_info["price_cents"] or 0)
-            except:
-                pass
+        try:
+            ids = [int(sid) for sid in service_ids]
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "invalid_service"})
+        selected_services = storage.get_services_by_ids(ids, barber_id=barber_id, barbershop_id=barbershop_id)
+        if len(selected_services) != len(set(ids)):
+            return jsonify({"success": False, "error": "invalid_service"})
+        total_price_cents = sum(sv["price_cents"] or 0 for sv in selected_services)
     else:
         # Fallback para serviços padrão se não houver IDs (compatibilidade ou falta de cadastro)
         s_lower = service.lower()
@@ -339,16 +564,6 @@ def reservar():
         elif "barba" in s_lower:
             total_price_cents = 2000
 
-    # Pega ID do barbeiro da requisição
-    barber_id = request.form.get("barber_id") or (request.json and request.json.get("barber_id"))
-    customer_name = request.form.get("customer_name") or (request.json and request.json.get("customer_name"))
-    
-    try:
-        if barber_id:
-            barber_id = int(barber_id)
-    except:
-        barber_id = None
-
     ok = storage.create_booking(
         user_id, dia, horario, service, 
         year=year, month=month, 
@@ -356,7 +571,9 @@ def reservar():
         barber_id=barber_id, 
         customer_name=customer_name, 
         barbershop_id=barbershop_id, 
-        price_cents=total_price_cents
+        price_cents=total_price_cents,
+        service_id=selected_services[0]["id"] if len(selected_services) == 1 else None,
+        services=selected_services
     )
     if ok:
         return jsonify({"success": True})
@@ -490,10 +707,6 @@ def meus_agendamentos():
     rows = storage.get_bookings_by_user(user_id)
     return render_template("meus_agendamentos.html", bookings=rows)
 
-def user_owns_booking(user_id, booking_id):
-    rows = storage.get_bookings_by_user(user_id)
-    return any(r["id"] == booking_id for r in rows)
-
 @app.route("/cancelar", methods=["POST"])
 def cancelar():
     if "usuario" not in session:
@@ -508,12 +721,54 @@ def cancelar():
     role = session.get("role")
     user_id = session.get("user_id")
 
-    if role == "barbeiro" or user_owns_booking(user_id, booking_id):
-        storage.cancel_booking(booking_id)
+    # Barbeiro cancela os agendamentos da sua agenda; cliente, os próprios
+    if role == "barbeiro":
+        ok = storage.cancel_booking(booking_id, barber_id=user_id)
+    else:
+        ok = storage.cancel_booking(booking_id, user_id=user_id)
+    if ok:
         return jsonify({"success": True})
     else:
         return jsonify({"success": False, "error": "not_allowed"}), 403
 
+BOOKINGS_PAGE_SIZE = 50
+BOOKINGS_MAX_PAGE_SIZE = 200
+
+def encode_booking_cursor(key):
+    # Cursor = "YYYY-MM-DD|minuto_do_dia|id" do último agendamento entregue
+    return f"{key[0]}|{key[1]}|{key[2]}"
+
+def decode_booking_cursor(raw):
+    try:
+        data, minuto, booking_id = raw.split("|")
+        datetime.strptime(data, "%Y-%m-%d")
+        return (data, int(minuto), int(booking_id))
+    except (AttributeError, ValueError):
+        return None
+
+def booking_to_dict(r):
+    return {
+        "id": r["id"],
+        "cliente": r["customer_name"] if r["customer_name"] else r["username"],
+        "phone": r["customer_phone"],
+        "day": r["day"],
+        "month": r["month"],
+        "year": r["year"],
+        "time": r["time"],
+        "status": r["status"],
+        "service": r["service"] or "corte de cabelo"
+    }
+
+def fetch_bookings_page(barber_id, barbershop_id, after=None, before=None, limit=BOOKINGS_PAGE_SIZE):
+    # Busca limit+1 para saber se existe próxima página sem um COUNT
+    rows = storage.get_bookings_page(barber_id, barbershop_id, after=after, before=before, limit=limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_booking_cursor((last["date_iso"], last["minute_of_day"], last["id"]))
+    return {"agendamentos": [booking_to_dict(r) for r in rows], "next_cursor": next_cursor}
+
 @app.route("/painel_barbeiro")
 def painel_barbeiro():
     if "user_id" not in session:
@@ -522,7 +777,10 @@ def painel_barbeiro():
         return redirect(url_for("agenda"))
 
     barbershop_id = session.get("barbershop_id")
-    bookings = storage.get_all_bookings_with_usernames(barber_id=session["user_id"], barbershop_id=barbershop_id)
+    # Por padrão só os próximos agendamentos; o histórico vem sob demanda em /api/agendamentos
+    now = get_local_now()
+    inicio = (now.strftime("%Y-%m-%d"), now.hour * 60 + now.minute, 0)
+    proximos = fetch_bookings_page(session["user_id"], barbershop_id, after=inicio)
     try:
         mes = int(request.args.get("mes")) if request.args.get("mes") else None
         ano = int(request.args.get("ano")) if request.args.get("ano") else None
@@ -533,7 +791,6 @@ def painel_barbeiro():
     dados_cal = build_dias_from_db(year=ano, month=mes, barber_id=session["user_id"], barbershop_id=barbershop_id)
 
     # Buscar agendamentos de HOJE
-    now = get_local_now()
     agendamentos_hoje_rows = storage.get_bookings_by_day_with_usernames(now.day, now.year, now.month, barber_id=session["user_id"], barbershop_id=barbershop_id)
     agendamentos_hoje = []
     for r in agendamentos_hoje_rows:
@@ -548,7 +805,14 @@ def painel_barbeiro():
             "service": r["service"] or "corte de cabelo"
         })
 
-    return render_template("painel_barbeiro.html", bookings=bookings, agendamentos_hoje=agendamentos_hoje, **dados_cal)
+    return render_template(
+        "painel_barbeiro.html",
+        bookings=proximos["agendamentos"],
+        next_cursor=proximos["next_cursor"],
+        older_cursor=encode_booking_cursor(inicio),
+        agendamentos_hoje=agendamentos_hoje,
+        **dados_cal
+    )
 
 @app.route("/financeiro", methods=["GET", "POST"])
 def financeiro():
@@ -651,6 +915,25 @@ def api_agendamentos_dia(dia):
         })
     return jsonify({"success": True, "dia": dia, "agendamentos": dados})
 
+@app.route("/api/agendamentos")
+def api_agendamentos():
+    # Histórico paginado: ?before=<cursor> (mais antigos) ou ?after=<cursor> (próximos)
+    if "user_id" not in session or session.get("role") != "barbeiro":
+        return jsonify({"success": False, "error": "not_allowed"}), 403
+    limit = request.args.get("limit", BOOKINGS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, BOOKINGS_MAX_PAGE_SIZE))
+    before = after = None
+    if request.args.get("before"):
+        before = decode_booking_cursor(request.args.get("before"))
+        if before is None:
+            return jsonify({"success": False, "error": "invalid_cursor"}), 400
+    elif request.args.get("after"):
+        after = decode_booking_cursor(request.args.get("after"))
+        if after is None:
+            return jsonify({"success": False, "error": "invalid_cursor"}), 400
+    page = fetch_bookings_page(session["user_id"], session.get("barbershop_id"), after=after, before=before, limit=limit)
+    return jsonify({"success": True, **page})
+
 # === ROTAS PARA EDIÇÃO/EXCLUSÃO ===
 # Observação: Estas rotas verificam role == 'barbeiro' antes de permitir ação.
 
@@ -745,16 +1028,31 @@ def editar_horario(horario_id):
 
     return render_template("editar_horario.html", horario=horario)
 
+def set_slot_active_from_form(active):
+    # Slots calculados a partir do modelo semanal não têm id: usa dia/mês/ano/horário do form
+    try:
+        day = int(request.form.get("day"))
+        month = int(request.form.get("month"))
+        year = int(request.form.get("year"))
+    except (TypeError, ValueError):
+        return
+    time = request.form.get("time")
+    if time:
+        storage.set_slot_active_at(day, time, active, year, month, barber_id=session["user_id"], barbershop_id=session.get("barbershop_id"))
+
 @app.route('/excluir_horario/<int:horario_id>', methods=['POST'])
 def excluir_horario(horario_id):
     if "role" not in session or session.get("role") != "barbeiro":
         return redirect(url_for("agenda"))
 
     # Marca o horário (slot) como inativo em availability
-    horario_row = storage.get_horario_by_id(horario_id)
+    horario_row = storage.get_horario_by_id(horario_id) if horario_id else None
     if horario_row:
         # atualiza para ativo = 0
         storage.update_horario(horario_id, horario_row["time"], False)
+    else:
+        # Slot do modelo semanal (sem linha em availability): cria a exceção
+        set_slot_active_from_form(0)
     # Tenta voltar para a página anterior com os mesmos parâmetros se possível
     # Mas como o referer pode ser complexo, voltamos para painel ou tentamos deduzir.
     # O ideal seria receber dia/mes/ano no form.
@@ -764,7 +1062,10 @@ def excluir_horario(horario_id):
 def ativar_horario(horario_id):
     if "role" not in session or session.get("role") != "barbeiro":
         return redirect(url_for("agenda"))
-    storage.set_slot_active(horario_id, 1)
+    if horario_id:
+        storage.set_slot_active(horario_id, 1)
+    else:
+        set_slot_active_from_form(1)
     return redirect(request.referrer or url_for("painel_barbeiro"))
 
 @app.route('/liberar_horario_dia', methods=['POST'])
@@ -779,7 +1080,7 @@ def liberar_horario_dia():
     slot_id = request.form.get("slot_id")
 
     if day and time and month and year:
-        storage.cancel_booking_by_details(int(day), time, int(year), int(month))
+        storage.cancel_booking_by_details(int(day), time, int(year), int(month), barber_id=session["user_id"], barbershop_id=session.get("barbershop_id"))
     
     # Também garante que o slot esteja ativo na tabela availability
     if slot_id:
@@ -787,6 +1088,9 @@ def liberar_horario_dia():
 
     return redirect(request.referrer or url_for("painel_barbeiro"))
 
+ADMIN_PAGE_SIZE = 50
+ADMIN_MAX_PAGE_SIZE = 200
+
 @app.route("/admin")
 def admin_dashboard():
     if "user_id" not in session:
@@ -797,8 +1101,22 @@ def admin_dashboard():
     if role != "admin":
         return redirect(url_for("agenda"))
         
-    shops = storage.get_all_barbershops_with_stats()
-    return render_template("admin_dashboard.html", shops=shops)
+    # Paginação por keyset: after_name/after_id = última barbearia da página anterior
+    per_page = request.args.get("per_page", ADMIN_PAGE_SIZE, type=int)
+    per_page = max(1, min(per_page, ADMIN_MAX_PAGE_SIZE))
+    after_name = request.args.get("after_name")
+    after_id = request.args.get("after_id", type=int)
+    if after_name is None or after_id is None:
+        after_name = after_id = None
+
+    shops = storage.get_all_barbershops_with_stats(after_name=after_name, after_id=after_id, limit=per_page + 1)
+    next_page = None
+    if len(shops) > per_page:
+        shops = shops[:per_page]
+        next_page = {"after_name": shops[-1]["name"], "after_id": shops[-1]["id"], "per_page": per_page}
+    total_shops = storage.count_barbershops()
+    return render_template("admin_dashboard.html", shops=shops, total_shops=total_shops,
+                           next_page=next_page, is_first_page=after_id is None, per_page=per_page)
 
 @app.route("/admin/barbershop/<int:shop_id>", methods=["GET", "POST"])
 def admin_barbershop_details(shop_id):
@@ -847,6 +1165,23 @@ def admin_delete_barbershop(shop_id):
     storage.delete_barbershop(shop_id)
     return redirect(url_for("admin_dashboard"))
 
+@app.route("/admin/cache")
+def admin_cache_stats():
+    # Contadores do cache de leitura deste worker (cada processo tem o seu)
+    if "user_id" not in session or session.get("role") != "admin":
+        return jsonify({"success": False, "error": "not_allowed"}), 403
+    return jsonify({"success": True, "pid": os.getpid(), "cache": storage.cache_stats()})
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # Admin logado ou coleta local (Prometheus na própria VPS). Atrás do nginx o
+    # remote_addr também é 127.0.0.1, então requisições com X-Forwarded-For não contam.
+    local = request.remote_addr in ("127.0.0.1", "::1") and "X-Forwarded-For" not in request.headers
+    if not local and session.get("role") != "admin":
+        return "Acesso negado", 403
+    body, content_type = metrics.render()
+    return body, 200, {"Content-Type": content_type}
+
 @app.route("/admin/barbershop/<int:shop_id>/toggle_status", methods=["POST"])
 def admin_toggle_barbershop_status(shop_id):
     if "user_id" not in session or session.get("role") != "admin":
@@ -864,6 +1199,32 @@ def setup_admin():
         return "Admin criado com sucesso: admin / admin123"
     return "Admin já existe ou erro."
 
+@app.cli.command("seed-shop")
+@click.argument("shop_id", type=int)
+def seed_shop_command(shop_id):
+    # Uso: flask --app app seed-shop <shop_id>
+    seeded = storage.seed_barbershop(shop_id)
+    click.echo(f"Modelo semanal padrão gravado para {seeded} barbeiro(s) da barbearia {shop_id}")
+
+@app.cli.command("rebuild-stats")
+def rebuild_stats_command():
+    # Uso: flask --app app rebuild-stats
+    storage.rebuild_monthly_stats()
+    click.echo("Totais mensais recalculados")
+
+@app.cli.command("db-version")
+def db_version_command():
+    # Uso: flask --app app db-version
+    click.echo(f"Schema na versão {storage.schema_version()} (atual: {storage.SCHEMA_VERSION})")
+
+@app.cli.command("slot-index")
+def slot_index_command():
+    # Uso: flask --app app slot-index (depois de resolver agendamentos em duplicidade)
+    if storage.create_slot_unique_index():
+        click.echo("idx_bookings_slot_unique criado")
+    else:
+        click.echo("Ainda existem agendamentos confirmados em duplicidade", err=True)
+
 if __name__ == "__main__":
     # host='0.0.0.0' permite acesso da rede local (necessário para teste real via celular)
     app.run(debug=True, host='0.0.0.0')
@@ -0,0 +1,368 @@
+"""Benchmark das funções mais usadas de storage.py.
+
+Cria um banco temporário com dados sintéticos (sempre os mesmos, semente fixa),
+chama cada função várias vezes e mostra a latência por chamada (média, p50,
+p95, p99) e quantos comandos SQL cada chamada executa. As chamadas são feitas
+em várias rodadas (--repeats) e a comparação usa o menor p50 entre elas, que
+oscila bem menos que o p50 de uma rodada só. O resultado é comparado com o
+baseline gravado em bench_baseline.json: se esse p50 de alguma função piorar
+mais que o limite (padrão 25%) e mais que --min-delta (padrão 0,05 ms, abaixo
+disso é ruído de funções que levam frações de milissegundo) ou se ela passar
+a executar mais comandos, o script termina com exit 1.
+
+Uso:
+    python bench_storage.py                  # compara com o baseline
+    python bench_storage.py --save           # grava um novo baseline
+    python bench_storage.py --threshold 0.5 --iterations 500 --scale 2
+    python bench_storage.py --only get_availability,create_booking
+    python bench_storage.py --dataset scale.db   # banco de generate_dataset.py
+
+Tempos dependem da máquina: grave o baseline na mesma máquina em que vai
+comparar (ex.: antes e depois de uma mudança em storage.py).
+
+Com --dataset o banco sintético não é criado: o arquivo indicado é copiado
+para um diretório temporário (as reservas do benchmark não alteram o
+original) e as funções rodam sobre os dados dele.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import calendar
+import platform
+import tempfile
+import statistics
+from datetime import datetime
+
+import storage
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+SHOPS_PER_SCALE = 20
+BARBERS_PER_SHOP = 3
+CLIENTS_PER_SHOP = 20
+SERVICES_PER_BARBER = 3
+HISTORY_MONTHS = 6
+# Fração dos horários do modelo que viram agendamentos no histórico
+OCCUPANCY = 0.3
+# Fração de horários desativados (exceções em availability)
+INACTIVE_SLOTS = 0.03
+SEED = 42
+
+
+def _months_back(now, count):
+    # (ano, mês) dos últimos `count` meses, terminando no mês atual
+    months = []
+    year, month = now.year, now.month
+    for _ in range(count):
+        months.append((year, month))
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return list(reversed(months))
+
+
+def seed_database(scale=1):
+    # Dados inseridos em lote em uma única transação; os triggers mantêm
+    # date_iso, booking_monthly_stats e calendar_versions como em produção.
+    rnd = random.Random(SEED)
+    now = datetime.now()
+    times = storage.generate_default_times()
+    password_hash = storage.hash_password("bench")
+
+    conn = storage.get_conn()
+    cur = conn.cursor()
+    storage._begin_immediate(conn, cur)
+
+    barbers = []  # (barber_id, shop_id)
+    clients = {}  # shop_id -> [client_id]
+    for s in range(SHOPS_PER_SCALE * scale):
+        cur.execute("INSERT INTO barbershops(name, slug, phone) VALUES(?, ?, ?)", (f"Barbearia {s:04d}", f"barbearia-{s:04d}", f"1190000{s:04d}"))
+        shop_id = cur.lastrowid
+        for b in range(BARBERS_PER_SHOP):
+            cur.execute(
+                "INSERT INTO users(username, password_hash, role, barbearia_nome, barbershop_id) VALUES(?, ?, 'barbeiro', ?, ?)",
+                (f"barbeiro_{s}_{b}", password_hash, f"Barbearia {s:04d}", shop_id),
+            )
+            barbers.append((cur.lastrowid, shop_id))
+        clients[shop_id] = []
+        for c in range(CLIENTS_PER_SHOP):
+            cur.execute(
+                "INSERT INTO users(username, password_hash, role, barbershop_id) VALUES(?, ?, 'cliente', ?)",
+                (f"cliente_{s}_{c}", password_hash, shop_id),
+            )
+            clients[shop_id].append(cur.lastrowid)
+
+    template_rows = []
+    service_rows = []
+    for barber_id, shop_id in barbers:
+        template_rows.extend(storage._template_rows(barber_id, shop_id, times))
+        for i in range(SERVICES_PER_BARBER):
+            service_rows.append((barber_id, shop_id, f"Serviço {i}", 2000 + 500 * i))
+    cur.executemany("INSERT INTO schedule_templates(barber_id, barbershop_id, weekday, time) VALUES(?, ?, ?, ?)", template_rows)
+    cur.executemany("INSERT INTO services(barber_id, barbershop_id, name, price_cents, active) VALUES(?, ?, ?, ?, 1)", service_rows)
+
+    booking_rows = []
+    inactive_rows = []
+    created_at = now.replace(microsecond=0)
+    for year, month in _months_back(now, HISTORY_MONTHS):
+        days = range(1, calendar.monthrange(year, month)[1] + 1)
+        for barber_id, shop_id in barbers:
+            for day, t in ((d, t) for d in days for t in times):
+                r = rnd.random()
+                if r < OCCUPANCY:
+                    booking_rows.append((
+                        rnd.choice(clients[shop_id]), day, month, year, t, "confirmado", created_at,
+                        "corte de cabelo", barber_id, shop_id, rnd.choice((2000, 2500, 3000)),
+                    ))
+                elif r < OCCUPANCY + INACTIVE_SLOTS:
+                    inactive_rows.append((day, month, year, t, barber_id, shop_id))
+    cur.executemany(
+        "INSERT INTO bookings(user_id, day, month, year, time, status, created_at, service, barber_id, barbershop_id, price_cents) "
+        "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        booking_rows,
+    )
+    cur.executemany(
+        "INSERT INTO availability(day, month, year, time, active, barber_id, barbershop_id) VALUES(?, ?, ?, ?, 0, ?, ?)",
+        inactive_rows,
+    )
+    conn.commit()
+    conn.close()
+    return {
+        "barbershops": SHOPS_PER_SCALE * scale,
+        "barbers": len(barbers),
+        "bookings": len(booking_rows),
+        "availability": len(inactive_rows),
+    }, barbers
+
+
+def load_dataset(path):
+    # Cópia consistente mesmo com WAL pendente no arquivo original
+    target = os.path.join(tempfile.mkdtemp(), os.path.basename(path))
+    src = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    src.backup(dst)
+    dst.close()
+    src.close()
+    os.environ["DATABASE_URL"] = "sqlite:///" + target
+
+    conn = storage.get_conn()
+    cur = conn.cursor()
+    counts = {}
+    for table in ("barbershops", "users", "bookings", "availability"):
+        cur.execute(f"SELECT COUNT(*) FROM {table}")
+        counts[table] = cur.fetchone()[0]
+    cur.execute("SELECT id, barbershop_id FROM users WHERE role = 'barbeiro' AND barbershop_id IS NOT NULL ORDER BY id")
+    barbers = [(r["id"], r["barbershop_id"]) for r in cur.fetchall()]
+    conn.close()
+    counts["barbers"] = len(barbers)
+    return counts, barbers
+
+
+def _free_slots(barbers, times, year):
+    # Horários ainda livres (ano sem agendamentos) para create_booking
+    for month in range(1, 13):
+        for day in range(1, 29):
+            for barber_id, shop_id in barbers:
+                for t in times:
+                    yield barber_id, shop_id, year, month, day, t
+
+
+def _any_client(shop_id):
+    conn = storage.get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM users WHERE role = 'cliente' AND barbershop_id = ? ORDER BY id LIMIT 1", (shop_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row["id"]
+
+
+def build_cases(barbers):
+    # nome -> função sem argumentos chamada a cada iteração
+    now = datetime.now()
+    times = storage.generate_default_times()
+    barber_id, shop_id = barbers[len(barbers) // 2]
+    client_id = _any_client(shop_id)
+    day = min(now.day, 28)
+    free = _free_slots(barbers, times, now.year + 5)
+
+    def create_booking():
+        b, s, y, m, d, t = next(free)
+        storage.create_booking(client_id, d, t, year=y, month=m, barber_id=b, barbershop_id=s, price_cents=2500)
+
+    return {
+        "get_availability": lambda: storage.get_availability(day, now.year, now.month, barber_id, shop_id),
+        "create_booking": create_booking,
+        "is_slot_taken": lambda: storage.is_slot_taken(day, "09:00", now.year, now.month, barber_id, shop_id),
+        "get_all_bookings_with_usernames": lambda: storage.get_all_bookings_with_usernames(barber_id, shop_id),
+        "get_monthly_stats_for_barber": lambda: storage.get_monthly_stats_for_barber(barber_id, shop_id),
+        "get_all_barbershops_with_stats": lambda: storage.get_all_barbershops_with_stats(limit=51),
+    }
+
+
+def _percentile(sorted_values, p):
+    # Interpolação linear entre as duas amostras mais próximas
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def run_case(call, iterations, warmup, repeats=1):
+    for _ in range(warmup):
+        call()
+    conn = storage.get_conn()
+    statements = []
+    if isinstance(conn, sqlite3.Connection):
+        conn.set_trace_callback(statements.append)
+        try:
+            call()
+        finally:
+            conn.set_trace_callback(None)
+    samples = []
+    round_p50 = []
+    for _ in range(repeats):
+        round_samples = []
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            call()
+            round_samples.append((time.perf_counter() - t0) * 1000)
+        round_samples.sort()
+        round_p50.append(_percentile(round_samples, 50))
+        samples.extend(round_samples)
+    samples.sort()
+    return {
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "p50_ms": round(_percentile(samples, 50), 4),
+        # Menor p50 entre as rodadas: é o valor comparado com o baseline
+        "p50_min_ms": round(min(round_p50), 4),
+        "p95_ms": round(_percentile(samples, 95), 4),
+        "p99_ms": round(_percentile(samples, 99), 4),
+        "max_ms": round(samples[-1], 4),
+        # Inclui os comandos dos triggers; None fora do SQLite
+        "statements": len(statements) if isinstance(conn, sqlite3.Connection) else None,
+    }
+
+
+def _compared_p50(r):
+    # Baselines antigos só têm o p50 de uma rodada
+    return r.get("p50_min_ms", r["p50_ms"])
+
+
+def compare(results, baseline, threshold, min_delta=0.0):
+    # Lista de (função, motivo) das regressões em relação ao baseline. Uma
+    # piora no p50 precisa passar do limite relativo e também de min_delta (ms).
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        before, after = _compared_p50(base), _compared_p50(r)
+        if after > before * (1 + threshold) and after - before > min_delta:
+            regressions.append((name, f"p50 {before:.3f} -> {after:.3f} ms"))
+        if r["statements"] is not None and base.get("statements") is not None and r["statements"] > base["statements"]:
+            regressions.append((name, f"comandos SQL {base['statements']} -> {r['statements']}"))
+    return regressions
+
+
+def print_table(results, baseline):
+    base_results = (baseline or {}).get("results", {})
+    print(f"{'função':34} {'média':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'SQL':>5} {'p50 mín':>8} {'base':>8} {'Δ':>7}")
+    for name, r in results.items():
+        base = base_results.get(name)
+        p50 = _compared_p50(r)
+        base_p50 = f"{_compared_p50(base):8.3f}" if base else f"{'-':>8}"
+        delta = f"{(p50 / _compared_p50(base) - 1) * 100:+6.0f}%" if base and _compared_p50(base) else f"{'-':>7}"
+        statements = "-" if r["statements"] is None else r["statements"]
+        print(f"{name:34} {r['mean_ms']:8.3f} {r['p50_ms']:8.3f} {r['p95_ms']:8.3f} {r['p99_ms']:8.3f} {statements:>5} {p50:8.3f} {base_p50} {delta}")
+    print("(tempos em ms por chamada; p50 mín = menor p50 entre as rodadas, o valor comparado)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das funções de storage.py")
+    parser.add_argument("--iterations", type=int, default=200, help="chamadas medidas por rodada (padrão 200)")
+    parser.add_argument("--repeats", type=int, default=5, help="rodadas por função (padrão 5)")
+    parser.add_argument("--warmup", type=int, default=10, help="chamadas descartadas antes de medir (padrão 10)")
+    parser.add_argument("--scale", type=int, default=1, help=f"multiplica o número de barbearias ({SHOPS_PER_SCALE} por unidade)")
+    parser.add_argument("--threshold", type=float, default=0.25, help="piora tolerada no p50 (0.25 = 25%%)")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="piora absoluta mínima no p50 para contar como regressão, em ms (padrão 0.05)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="arquivo do baseline (padrão bench_baseline.json)")
+    parser.add_argument("--save", action="store_true", help="grava o resultado como novo baseline")
+    parser.add_argument("--only", help="funções separadas por vírgula")
+    parser.add_argument("--database-url", help="banco vazio a usar no lugar do SQLite temporário (ex.: postgresql://...)")
+    parser.add_argument("--dataset", help="usa uma cópia deste banco SQLite (ver generate_dataset.py) em vez de gerar dados")
+    args = parser.parse_args(argv)
+    if args.dataset and args.database_url:
+        parser.error("use --dataset ou --database-url, não os dois")
+    if args.dataset and not os.path.exists(args.dataset):
+        parser.error(f"arquivo não encontrado: {args.dataset}")
+
+    t0 = time.perf_counter()
+    if args.dataset:
+        counts, barbers = load_dataset(args.dataset)
+        # Banco gerado com uma versão anterior do schema
+        storage.init_db()
+    else:
+        # storage lê DATABASE_URL a cada conexão
+        os.environ["DATABASE_URL"] = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+        storage.init_db()
+        counts, barbers = seed_database(args.scale)
+    print(f"banco: {storage.get_backend().name}, " + ", ".join(f"{k}={v}" for k, v in counts.items())
+          + f" ({time.perf_counter() - t0:.1f}s)")
+
+    cases = build_cases(barbers)
+    if args.only:
+        names = [n.strip() for n in args.only.split(",")]
+        unknown = [n for n in names if n not in cases]
+        if unknown:
+            parser.error("funções desconhecidas: " + ", ".join(unknown))
+        cases = {n: cases[n] for n in names}
+
+    results = {}
+    for name, call in cases.items():
+        results[name] = run_case(call, args.iterations, args.warmup, args.repeats)
+
+    meta = {
+        "backend": storage.get_backend().name,
+        "scale": os.path.basename(args.dataset) if args.dataset else args.scale,
+        "iterations": args.iterations,
+        "repeats": args.repeats,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "date": datetime.now().strftime("%Y-%m-%d"),
+    }
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print_table(results, None)
+        print(f"baseline gravado em {args.baseline}")
+        return 0
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+    if baseline is None:
+        print(f"sem baseline em {args.baseline} (rode com --save para criar)")
+        return 0
+    base_meta = baseline.get("meta", {})
+    for key in ("backend", "scale"):
+        if base_meta.get(key) != meta[key]:
+            print(f"aviso: baseline gravado com {key}={base_meta.get(key)}, esta execução usa {key}={meta[key]}")
+
+    regressions = compare(results, baseline, args.threshold, args.min_delta)
+    for name, reason in regressions:
+        print(f"REGRESSÃO {name}: {reason}")
+    print(f"{len(results)} funções medidas, {len(regressions)} regressões (limite {args.threshold:.0%} e {args.min_delta} ms)")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
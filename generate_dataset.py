@@ -0,0 +1,342 @@
+"""Gera um banco SQLite com dados sintéticos em grande volume (testes de escala).
+
+O schema é criado por storage.init_db, então o arquivo gerado serve para subir
+o app (DATABASE_URL=sqlite:///<arquivo>) e para bench_storage.py --dataset.
+Os dados seguem distribuições parecidas com as de produção:
+
+- barbearias com popularidades diferentes;
+- modelos semanais com folga no domingo (e às vezes na segunda);
+- mais movimento no fim da tarde, às sextas e aos sábados e em dezembro;
+- crescimento ao longo do período;
+- clientes frequentes, reservas públicas com nome/telefone e ~8% de
+  cancelamentos;
+- férias, folgas e horários bloqueados como exceções em availability;
+- a agenda do mês seguinte parcialmente preenchida.
+
+Carga rápida: durante a inserção o banco roda sem journal, sem triggers e sem
+os índices de bookings/availability. date_iso/minute_of_day são preenchidas
+direto, booking_monthly_stats é recalculada no fim e os índices e triggers são
+recriados com o SQL original (calendar_versions e cache_generations começam
+zeradas, como em um banco novo).
+
+Uso:
+    python generate_dataset.py scale.db --shops 1000 --barbers 3 --years 2
+    python generate_dataset.py scale.db --shops 100 --force   # sobrescreve
+
+Todos os usuários gerados têm a senha de --password (padrão "senha123").
+"""
+import os
+import sys
+import math
+import time
+import random
+import sqlite3
+import calendar
+import argparse
+from datetime import date, datetime, timedelta
+
+import storage
+
+SERVICE_CATALOG = (
+    # nome, preço base (centavos), peso na escolha
+    ("Corte", 3500, 50),
+    ("Barba", 2500, 15),
+    ("Corte + Barba", 5500, 25),
+    ("Sobrancelha", 1000, 4),
+    ("Pigmentação", 4000, 3),
+    ("Hidratação", 3000, 3),
+)
+# Segunda ... Domingo
+WEEKDAY_DEMAND = (0.6, 0.7, 0.75, 0.85, 1.1, 1.35, 0.5)
+# Janeiro ... Dezembro
+MONTH_DEMAND = (0.85, 0.9, 1.0, 1.0, 1.0, 0.95, 1.0, 1.0, 0.95, 1.0, 1.05, 1.25)
+# Tabelas cujos índices são removidos durante a carga (os triggers saem de todas)
+BULK_TABLES = ("bookings", "availability")
+BATCH_ROWS = 50000
+
+
+def hour_demand(t):
+    h = int(t[:2])
+    if h < 11:
+        return 0.8
+    if h < 16:
+        return 0.75
+    return 1.3
+
+
+def month_range(start, end):
+    # (ano, mês) de start a end, inclusive
+    year, month = start
+    while (year, month) <= end:
+        yield year, month
+        month += 1
+        if month == 13:
+            year, month = year + 1, 1
+
+
+def open_bulk_conn(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA locking_mode=EXCLUSIVE")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-262144")
+    return conn
+
+
+def drop_bulk_ddl(conn):
+    # Remove os triggers e os índices das tabelas grandes e devolve o SQL para recriá-los
+    rows = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL "
+        "AND (type='trigger' OR (type='index' AND tbl_name IN (%s)))" % ",".join("?" * len(BULK_TABLES)),
+        BULK_TABLES,
+    ).fetchall()
+    for kind, name, _ in rows:
+        conn.execute(f"DROP {kind.upper()} {name}")
+    return rows
+
+
+def restore_bulk_ddl(conn, rows):
+    # Índices antes dos triggers, como nas migrações
+    for kind, _, sql in sorted(rows, key=lambda r: r[0] != "index"):
+        conn.execute(sql)
+
+
+class Generator:
+    def __init__(self, args):
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.times = storage.generate_default_times()
+        self.minutes = {t: storage.time_to_minutes(t) for t in self.times}
+        self.next_id = {}
+        self.counts = {}
+
+    def new_id(self, table):
+        self.next_id[table] += 1
+        return self.next_id[table]
+
+    def insert(self, cur, table, columns, rows):
+        if not rows:
+            return
+        cur.executemany(
+            f"INSERT INTO {table}({', '.join(columns)}) VALUES({', '.join('?' * len(columns))})",
+            rows,
+        )
+        self.counts[table] = self.counts.get(table, 0) + len(rows)
+
+    def run(self, conn, public_client_id):
+        args = self.args
+        rnd = self.rnd
+        cur = conn.cursor()
+        for table in ("barbershops", "users", "services", "schedule_templates", "bookings", "availability"):
+            self.next_id[table] = cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+        password_hash = storage.hash_password(args.password)
+
+        today = date.today()
+        end = (today.year + (today.month == 12), today.month % 12 + 1)
+        start_index = end[0] * 12 + end[1] - 1 - (args.years * 12)
+        start = (start_index // 12, start_index % 12 + 1)
+        months = list(month_range(start, end))
+
+        cur.execute("BEGIN")
+        for s in range(args.shops):
+            shop_id = self.new_id("barbershops")
+            name = f"Barbearia {s + 1:06d}"
+            self.insert(cur, "barbershops", ("id", "name", "slug", "phone", "address", "active"), [
+                (shop_id, name, f"barbearia-{s + 1:06d}", f"11{9 * 10 ** 8 + shop_id:09d}", f"Rua {s + 1}, {rnd.randint(1, 999)}", 1 if rnd.random() > 0.02 else 0),
+            ])
+            # Popularidade da barbearia (lognormal: poucas muito cheias, muitas medianas)
+            popularity = rnd.lognormvariate(0, 0.35)
+
+            clients = []
+            client_rows = []
+            for c in range(args.clients):
+                client_id = self.new_id("users")
+                clients.append(client_id)
+                client_rows.append((client_id, f"cliente_{shop_id}_{c + 1}", password_hash, "cliente", None,
+                                    f"11{8 * 10 ** 8 + client_id:09d}", shop_id, None))
+
+            barber_rows = []
+            for b in range(args.barbers):
+                barber_id = self.new_id("users")
+                barber_rows.append((barber_id, f"barbeiro_{shop_id}_{b + 1}", password_hash, "barbeiro", name,
+                                    f"11{7 * 10 ** 8 + barber_id:09d}", shop_id, f"barbeiro{barber_id}@example.com"))
+            self.insert(cur, "users", ("id", "username", "password_hash", "role", "barbearia_nome", "phone", "barbershop_id", "email"),
+                        barber_rows + client_rows)
+
+            for barber in barber_rows:
+                self.barber(cur, barber[0], shop_id, popularity, clients, public_client_id, months, today)
+
+            if (s + 1) % 50 == 0 or s + 1 == args.shops:
+                cur.execute("COMMIT")
+                cur.execute("BEGIN")
+                print(f"  {s + 1}/{args.shops} barbearias, {self.counts.get('bookings', 0):,} agendamentos", flush=True)
+        cur.execute("COMMIT")
+
+    def barber(self, cur, barber_id, shop_id, popularity, clients, public_client_id, months, today):
+        args = self.args
+        rnd = self.rnd
+
+        # Serviços: Corte sempre, os outros com chance decrescente
+        services = []
+        for i, (name, price, weight) in enumerate(SERVICE_CATALOG):
+            if i == 0 or rnd.random() < 0.8 - 0.1 * i:
+                services.append((self.new_id("services"), name, int(round(price * rnd.uniform(0.8, 1.3), -2)), weight))
+        self.insert(cur, "services", ("id", "barber_id", "barbershop_id", "name", "price_cents", "active"),
+                    [(sid, barber_id, shop_id, name, price, 1) for sid, name, price, _ in services])
+        # Sorteio ponderado: cada serviço aparece `peso` vezes
+        service_pool = [sv[:3] for sv in services for _ in range(sv[3])]
+
+        # Modelo semanal: folga no domingo (90%) e às vezes na segunda (30%)
+        days_off = set()
+        if rnd.random() < 0.9:
+            days_off.add(6)
+        if rnd.random() < 0.3:
+            days_off.add(0)
+        template = {wd: ([] if wd in days_off else self.times) for wd in range(7)}
+        self.insert(cur, "schedule_templates", ("id", "barber_id", "barbershop_id", "weekday", "time"),
+                    [(self.new_id("schedule_templates"), barber_id, shop_id, wd, t) for wd in range(7) for t in template[wd]])
+
+        skill = rnd.lognormvariate(0, 0.2)
+        vacations = {}
+        for year in {y for y, _ in months}:
+            # Uma semana de férias por ano
+            first = date(year, 1, 1) + timedelta(days=rnd.randrange(365))
+            for d in range(7):
+                vacations[first + timedelta(days=d)] = True
+
+        bookings = []
+        exceptions = []
+        hour_factor = {t: hour_demand(t) for t in self.times}
+        total_months = len(months)
+        for index, (year, month) in enumerate(months):
+            # Crescimento: o primeiro mês tem ~70% do movimento do último
+            trend = 0.7 + 0.3 * index / max(total_months - 1, 1)
+            base = args.occupancy * popularity * skill * trend * MONTH_DEMAND[month - 1]
+            for day in range(1, calendar.monthrange(year, month)[1] + 1):
+                current = date(year, month, day)
+                day_iso = current.isoformat()
+                wd = current.weekday()
+                times = template[wd]
+                if current in vacations or (times and rnd.random() < 0.02):
+                    # Férias e folgas avulsas: todos os horários do dia desativados
+                    exceptions.extend(self.slot(day, month, year, day_iso, t, 0, barber_id, shop_id) for t in times)
+                    continue
+                extra_day = not times and rnd.random() < 0.03
+                if extra_day:
+                    # Abre excepcionalmente em um dia de folga (manhã)
+                    times = self.times[:6]
+                    exceptions.extend(self.slot(day, month, year, day_iso, t, 1, barber_id, shop_id) for t in times)
+                ahead = (current - today).days
+                # Agenda futura ainda sendo preenchida
+                fill = 1.0 if ahead < 0 else max(0.05, 0.8 * math.exp(-ahead / 10))
+                day_base = base * WEEKDAY_DEMAND[wd] * fill
+                for t in times:
+                    r = rnd.random()
+                    if r < 0.01 and not extra_day:
+                        # Horário bloqueado no modelo
+                        exceptions.append(self.slot(day, month, year, day_iso, t, 0, barber_id, shop_id))
+                        continue
+                    if r >= min(0.97, day_base * hour_factor[t]):
+                        continue
+                    bookings.append(self.booking(current, day_iso, t, barber_id, shop_id, clients, public_client_id, service_pool))
+                if len(bookings) >= BATCH_ROWS:
+                    self.flush(cur, bookings, exceptions)
+        self.flush(cur, bookings, exceptions)
+
+    def slot(self, day, month, year, day_iso, t, active, barber_id, shop_id):
+        return (self.new_id("availability"), day, month, year, t, active, barber_id, shop_id, day_iso, self.minutes[t])
+
+    def booking(self, current, day_iso, t, barber_id, shop_id, clients, public_client_id, service_pool):
+        rnd = self.rnd
+        booking_id = self.new_id("bookings")
+        service_id, service_name, price = service_pool[int(rnd.random() * len(service_pool))]
+        minute = self.minutes[t]
+        # Reservado em média 3 dias antes do horário
+        starts_at = datetime(current.year, current.month, current.day, minute // 60, minute % 60)
+        created_at = (starts_at - timedelta(hours=rnd.expovariate(1 / 72) + 1)).isoformat(" ", "seconds")
+        if rnd.random() < 0.15:
+            # Reserva pública (/b/<slug>): cliente genérico com nome e telefone
+            user_id = public_client_id
+            customer_name = f"Cliente {rnd.randrange(10 ** 5):05d}"
+            customer_phone = f"11{rnd.randrange(9 * 10 ** 8, 10 ** 9)}"
+        else:
+            # Clientes frequentes concentram a maior parte dos agendamentos
+            user_id = clients[int(len(clients) * rnd.random() ** 2.5)]
+            customer_name = None
+            customer_phone = None
+        status = "cancelado" if rnd.random() < self.args.cancel_rate else "confirmado"
+        return (
+            (booking_id, user_id, current.day, current.month, current.year, t, status, created_at,
+             service_name, customer_phone, customer_name, barber_id, shop_id, service_id, price,
+             day_iso, minute),
+            (booking_id, service_id, service_name, price),
+        )
+
+    def flush(self, cur, bookings, exceptions):
+        self.insert(cur, "bookings", (
+            "id", "user_id", "day", "month", "year", "time", "status", "created_at", "service", "customer_phone",
+            "customer_name", "barber_id", "barbershop_id", "service_id", "price_cents", "date_iso", "minute_of_day",
+        ), [b for b, _ in bookings])
+        self.insert(cur, "booking_services", ("booking_id", "service_id", "name", "price_cents"), [s for _, s in bookings])
+        self.insert(cur, "availability", (
+            "id", "day", "month", "year", "time", "active", "barber_id", "barbershop_id", "date_iso", "minute_of_day",
+        ), exceptions)
+        bookings.clear()
+        exceptions.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera um banco SQLite com dados sintéticos em grande volume")
+    parser.add_argument("output", help="arquivo .db a criar")
+    parser.add_argument("--shops", type=int, default=100, help="barbearias (padrão 100)")
+    parser.add_argument("--barbers", type=int, default=3, help="barbeiros por barbearia (padrão 3)")
+    parser.add_argument("--clients", type=int, default=200, help="clientes cadastrados por barbearia (padrão 200)")
+    parser.add_argument("--years", type=int, default=2, help="anos de histórico até o mês que vem (padrão 2)")
+    parser.add_argument("--occupancy", type=float, default=0.55, help="ocupação média dos horários (padrão 0.55)")
+    parser.add_argument("--cancel-rate", type=float, default=0.08, help="fração de agendamentos cancelados (padrão 0.08)")
+    parser.add_argument("--seed", type=int, default=1, help="semente dos números aleatórios (padrão 1)")
+    parser.add_argument("--password", default="senha123", help="senha de todos os usuários gerados")
+    parser.add_argument("--force", action="store_true", help="sobrescreve o arquivo se ele existir")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.output):
+        if not args.force:
+            parser.error(f"{args.output} já existe (use --force para sobrescrever)")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.output + suffix):
+                os.remove(args.output + suffix)
+
+    t0 = time.perf_counter()
+    os.environ["DATABASE_URL"] = "sqlite:///" + args.output
+    storage.init_db()
+    public_client_id = storage.get_or_create_public_client()["id"]
+    storage.close_conn()
+
+    conn = open_bulk_conn(args.output)
+    ddl = drop_bulk_ddl(conn)
+    generator = Generator(args)
+    generator.run(conn, public_client_id)
+
+    print("recriando índices, triggers e booking_monthly_stats...", flush=True)
+    cur = conn.cursor()
+    cur.execute("BEGIN")
+    restore_bulk_ddl(conn, ddl)
+    storage._rebuild_monthly_stats(cur)
+    cur.execute("COMMIT")
+    conn.execute("PRAGMA locking_mode=NORMAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+
+    # Confere que o arquivo abre pelo caminho normal, já na versão atual do schema
+    storage.init_db()
+    version = storage.schema_version()
+    storage.close_conn()
+    size_mb = os.path.getsize(args.output) / 1024 / 1024
+    print(", ".join(f"{table}={n:,}" for table, n in generator.counts.items()))
+    print(f"{args.output}: {size_mb:,.0f} MB, schema versão {version}, {time.perf_counter() - t0:.0f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
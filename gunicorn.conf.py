@@ -0,0 +1,30 @@
+import os
+import glob
+import tempfile
+
+# Configuração do Gunicorn (Docker e systemd usam: gunicorn -c gunicorn.conf.py app:app)
+# Workers gthread: cada processo atende várias requisições ao mesmo tempo em
+# threads, então consultas lentas não enfileiram os demais clientes. Cada
+# thread usa a sua própria conexão SQLite (storage.get_conn).
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "3"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+
+# Métricas de /metrics: cada worker grava os seus valores neste diretório e a
+# coleta soma todos (modo multiprocesso do prometheus_client). Precisa estar
+# no ambiente antes de o app ser importado nos workers.
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "agenda_barbeiro_metrics"))
+
+def on_starting(server):
+    # Valores de uma execução anterior não entram na soma
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.remove(path)
+
+def child_exit(server, worker):
+    # Worker encerrado ou reiniciado: os medidores dele saem da soma
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,394 @@
+"""Teste de carga HTTP do app com fluxos de clientes e barbeiros.
+
+Sobe um gunicorn local (gunicorn.conf.py, com o número de workers/threads
+escolhido) sobre uma cópia de um banco de generate_dataset.py e dispara
+usuários virtuais em paralelo durante --duration segundos:
+
+- clientes: /b/<slug> -> /agenda -> 1 a 3 toques em /horarios/<dia> ->
+  /api/services -> POST /reservar (JSON, como static/script.js) em um dos
+  primeiros horários livres (vários clientes disputam os mesmos horários,
+  como num sábado cheio);
+- barbeiros: POST /login -> /painel_barbeiro -> /editar_dia/<dia> ->
+  /financeiro.
+
+No fim mostra requisições por segundo e p50/p95/p99 por rota, quantas
+reservas foram confirmadas, quantas voltaram slot_taken e os erros (status
+>= 400 ou falha de conexão). Termina com exit 1 se houve erro.
+
+Uso:
+    python load_test.py                                # banco pequeno gerado na hora
+    python load_test.py --dataset scale.db --workers 4 --threads 8 --users 50
+    python load_test.py --dataset scale.db --url http://127.0.0.1:8000   # servidor já rodando
+
+Com --url o banco não é copiado nem servido: --dataset só fornece as
+barbearias e barbeiros (senha --password) que o servidor alvo conhece.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit, urlencode, quote
+from datetime import datetime, timedelta, timezone
+
+import generate_dataset
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Mesmo fuso de app.get_local_now
+BR_TZ = timezone(timedelta(hours=-3))
+STARTUP_TIMEOUT = 30
+
+
+def _percentile(sorted_values, p):
+    # Interpolação linear entre as duas amostras mais próximas
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def load_targets(path, hot_shops):
+    # Barbearias ativas (as `hot_shops` primeiras) e seus barbeiros
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    cur = conn.cursor()
+    cur.execute("SELECT id, slug FROM barbershops WHERE active = 1 AND slug IS NOT NULL ORDER BY id")
+    shops = {}
+    for shop_id, slug in cur.fetchall():
+        shops[shop_id] = {"slug": slug, "barbers": []}
+    cur.execute("SELECT id, username, barbershop_id FROM users WHERE role = 'barbeiro' ORDER BY id")
+    for barber_id, username, shop_id in cur.fetchall():
+        if shop_id in shops:
+            shops[shop_id]["barbers"].append((barber_id, username))
+    conn.close()
+    targets = [s for s in shops.values() if s["barbers"]]
+    if not targets:
+        raise SystemExit(f"{path}: nenhuma barbearia ativa com barbeiros")
+    return targets[:hot_shops]
+
+
+def copy_database(path):
+    # Cópia consistente (inclui o WAL pendente); as reservas do teste não alteram o original
+    target = os.path.join(tempfile.mkdtemp(), os.path.basename(path))
+    src = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    src.backup(dst)
+    dst.close()
+    src.close()
+    return target
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(db_path, workers, threads):
+    port = _free_port()
+    log_path = os.path.join(os.path.dirname(db_path), "gunicorn.log")
+    env = dict(
+        os.environ,
+        DATABASE_URL="sqlite:///" + db_path,
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        # Sem DEBUG o cookie de sessão é Secure e não volta por HTTP
+        DEBUG="1",
+    )
+    log = open(log_path, "wb")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    log.close()
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"gunicorn terminou (código {proc.returncode}); veja {log_path}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/login")
+            conn.getresponse().read()
+            conn.close()
+            return proc, url, log_path
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit(f"gunicorn não respondeu em {STARTUP_TIMEOUT}s; veja {log_path}")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+class Client:
+    # Um usuário virtual: conexão keep-alive própria e cookie de sessão.
+    # Redirecionamentos não são seguidos, para cada rota ser medida separada.
+
+    def __init__(self, url, stats, timeout):
+        parts = urlsplit(url)
+        self.https = parts.scheme == "https"
+        self.host = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.stats = stats
+        self.timeout = timeout
+        self.cookies = {}
+        self.conn = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.conn = cls(self.host, timeout=self.timeout)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _send(self, method, path, body, headers):
+        if self.conn is None:
+            self._connect()
+        self.conn.request(method, self.prefix + path, body=body, headers=headers)
+        resp = self.conn.getresponse()
+        data = resp.read()
+        for header in resp.headers.get_all("Set-Cookie") or ():
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return resp.status, data
+
+    def request(self, method, path, route, form=None, payload=None):
+        headers = {}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        elif payload is not None:
+            body = json.dumps(payload)
+            headers["Content-Type"] = "application/json"
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        t0 = time.perf_counter()
+        try:
+            try:
+                status, data = self._send(method, path, body, headers)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # O servidor fechou a conexão keep-alive ociosa: tenta de novo uma vez
+                self.close()
+                status, data = self._send(method, path, body, headers)
+        except (OSError, http.client.HTTPException) as exc:
+            self.close()
+            self.stats.record(route, (time.perf_counter() - t0) * 1000, None, type(exc).__name__)
+            return None, None
+        self.stats.record(route, (time.perf_counter() - t0) * 1000, status)
+        return status, data
+
+    def get(self, path, route):
+        return self.request("GET", path, route)
+
+    def post(self, path, route, form=None, payload=None):
+        return self.request("POST", path, route, form, payload)
+
+
+class Stats:
+    # Amostras por rota; cada usuário virtual tem o seu, somados no fim
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.bookings = {}
+
+    def record(self, route, ms, status, error=None):
+        self.samples.setdefault(route, []).append(ms)
+        if error is None and status >= 400:
+            error = f"HTTP {status}"
+        if error:
+            self.error(route, error)
+
+    def error(self, route, error):
+        key = (route, error)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def booking(self, outcome):
+        self.bookings[outcome] = self.bookings.get(outcome, 0) + 1
+
+    def merge(self, other):
+        for route, values in other.samples.items():
+            self.samples.setdefault(route, []).extend(values)
+        for key, count in other.errors.items():
+            self.errors[key] = self.errors.get(key, 0) + count
+        for key, count in other.bookings.items():
+            self.bookings[key] = self.bookings.get(key, 0) + count
+
+
+def _pick_day(rnd, horizon):
+    day = datetime.now(BR_TZ).date() + timedelta(days=rnd.randint(0, horizon))
+    return day.day, day.month, day.year
+
+
+def customer_flow(client, shop, rnd, args):
+    client.get(f"/b/{quote(shop['slug'])}", "/b/<slug>")
+    client.get("/agenda", "/agenda")
+    barber_id, _ = rnd.choice(shop["barbers"])
+    horarios = []
+    for _ in range(rnd.randint(1, 3)):
+        dia, mes, ano = _pick_day(rnd, args.horizon)
+        status, data = client.get(f"/horarios/{dia}?ano={ano}&mes={mes}&barber_id={barber_id}", "/horarios/<dia>")
+        if status == 200:
+            horarios = json.loads(data)["horarios"]
+            if horarios:
+                break
+    if not horarios or rnd.random() >= args.book_rate:
+        return
+    status, data = client.get(f"/api/services?barber_id={barber_id}", "/api/services")
+    services = json.loads(data)["services"] if status == 200 else []
+    chosen = rnd.sample(services, min(len(services), rnd.choice((1, 1, 2))))
+    # Os primeiros horários do dia são os mais disputados
+    horario = rnd.choice(horarios[:3])
+    status, data = client.post("/reservar", "/reservar", payload={
+        "dia": dia, "mes": mes, "ano": ano, "horario": horario,
+        "service": " + ".join(s["name"] for s in chosen) or "corte de cabelo",
+        "service_ids": [s["id"] for s in chosen],
+        "barber_id": barber_id, "customer_name": f"Carga {rnd.randint(1, 9999)}",
+    })
+    if status != 200:
+        client.stats.booking("erro")
+        return
+    result = json.loads(data)
+    client.stats.booking("confirmada" if result.get("success") else result.get("error", "erro"))
+
+
+def barber_flow(client, shop, rnd, args):
+    _, username = rnd.choice(shop["barbers"])
+    status, _ = client.post("/login", "/login", {"usuario": username, "senha": args.password})
+    if status != 302:
+        client.stats.error("/login", "login recusado")
+        return
+    client.get("/painel_barbeiro", "/painel_barbeiro")
+    dia, mes, ano = _pick_day(rnd, args.horizon)
+    client.get(f"/editar_dia/{dia}?mes={mes}&ano={ano}", "/editar_dia/<dia>")
+    client.get("/financeiro", "/financeiro")
+
+
+def virtual_user(index, url, targets, args, deadline, results):
+    rnd = random.Random(args.seed * 100003 + index)
+    stats = Stats()
+    while time.monotonic() < deadline:
+        # Cada fluxo é uma visita nova (sessão e conexão novas)
+        client = Client(url, stats, args.timeout)
+        shop = rnd.choice(targets)
+        if rnd.random() < args.barber_share:
+            barber_flow(client, shop, rnd, args)
+        else:
+            customer_flow(client, shop, rnd, args)
+        client.close()
+        if args.think:
+            time.sleep(rnd.expovariate(1000 / args.think))
+    results[index] = stats
+
+
+def run_load(url, targets, args):
+    results = [None] * args.users
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=virtual_user, args=(i, url, targets, args, deadline, results), daemon=True)
+        for i in range(args.users)
+    ]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    total = Stats()
+    for stats in results:
+        if stats is not None:
+            total.merge(stats)
+    return total, elapsed
+
+
+def print_report(stats, elapsed):
+    errors_by_route = {}
+    for (route, _), count in stats.errors.items():
+        errors_by_route[route] = errors_by_route.get(route, 0) + count
+    print(f"{'rota':20} {'req':>7} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'máx':>8} {'erros':>6}")
+    all_samples = []
+    for route in sorted(stats.samples):
+        values = sorted(stats.samples[route])
+        all_samples.extend(values)
+        print(f"{route:20} {len(values):7d} {len(values) / elapsed:8.1f} {_percentile(values, 50):8.1f} "
+              f"{_percentile(values, 95):8.1f} {_percentile(values, 99):8.1f} {values[-1]:8.1f} {errors_by_route.get(route, 0):6d}")
+    if all_samples:
+        all_samples.sort()
+        print(f"{'total':20} {len(all_samples):7d} {len(all_samples) / elapsed:8.1f} {_percentile(all_samples, 50):8.1f} "
+              f"{_percentile(all_samples, 95):8.1f} {_percentile(all_samples, 99):8.1f} {all_samples[-1]:8.1f} {sum(stats.errors.values()):6d}")
+    print("(tempos em ms por requisição)")
+
+    attempts = sum(stats.bookings.values())
+    confirmed = stats.bookings.get("confirmada", 0)
+    taken = stats.bookings.get("slot_taken", 0)
+    others = ", ".join(f"{k}={v}" for k, v in sorted(stats.bookings.items()) if k not in ("confirmada", "slot_taken"))
+    print(f"reservas: {attempts} tentativas, {confirmed} confirmadas, {taken} slot_taken"
+          + (f" ({taken / attempts:.0%})" if attempts else "") + (f", {others}" if others else ""))
+    for (route, error), count in sorted(stats.errors.items()):
+        print(f"erro {route}: {error} x{count}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga HTTP do app")
+    parser.add_argument("--dataset", help="banco de generate_dataset.py (padrão: um pequeno gerado na hora)")
+    parser.add_argument("--url", help="servidor já rodando com o mesmo banco (não sobe o gunicorn)")
+    parser.add_argument("--workers", type=int, default=3, help="workers do gunicorn (padrão 3)")
+    parser.add_argument("--threads", type=int, default=8, help="threads por worker (padrão 8)")
+    parser.add_argument("--users", type=int, default=20, help="usuários virtuais simultâneos (padrão 20)")
+    parser.add_argument("--duration", type=float, default=30, help="duração em segundos (padrão 30)")
+    parser.add_argument("--barber-share", type=float, default=0.1, help="fração das visitas que são de barbeiros (padrão 0.1)")
+    parser.add_argument("--book-rate", type=float, default=0.6, help="fração dos clientes que tentam reservar (padrão 0.6)")
+    parser.add_argument("--shops", type=int, default=5, help="barbearias que recebem a carga (padrão 5)")
+    parser.add_argument("--horizon", type=int, default=7, help="dias à frente consultados e reservados (padrão 7)")
+    parser.add_argument("--think", type=float, default=0, help="pausa média entre visitas em ms (padrão 0)")
+    parser.add_argument("--timeout", type=float, default=30, help="timeout de cada requisição em segundos")
+    parser.add_argument("--password", default="senha123", help="senha dos barbeiros do banco")
+    parser.add_argument("--seed", type=int, default=1, help="semente dos números aleatórios")
+    args = parser.parse_args(argv)
+    if args.url and not args.dataset:
+        parser.error("--url exige --dataset (as barbearias e barbeiros vêm dele)")
+    if args.dataset and not os.path.exists(args.dataset):
+        parser.error(f"arquivo não encontrado: {args.dataset}")
+
+    dataset = args.dataset
+    if not dataset:
+        dataset = os.path.join(tempfile.mkdtemp(), "load.db")
+        generate_dataset.main([dataset, "--shops", str(max(args.shops, 10)), "--years", "1", "--password", args.password])
+    targets = load_targets(dataset, args.shops)
+
+    proc = None
+    url = args.url
+    if not url:
+        db_path = copy_database(dataset)
+        proc, url, log_path = start_server(db_path, args.workers, args.threads)
+        print(f"gunicorn {args.workers} workers x {args.threads} threads em {url} (log: {log_path})")
+    print(f"{args.users} usuários por {args.duration:g}s em {len(targets)} barbearias")
+    try:
+        stats, elapsed = run_load(url, targets, args)
+    finally:
+        if proc is not None:
+            stop_server(proc)
+    print_report(stats, elapsed)
+    return 1 if stats.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import os
+import time
+import sqlite3
+import inspect
+import functools
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Métricas no formato do Prometheus, expostas em /metrics (app.py).
+# Com o gunicorn cada worker é um processo separado: gunicorn.conf.py define
+# PROMETHEUS_MULTIPROC_DIR, cada processo grava os seus valores em arquivos
+# nesse diretório e o /metrics soma os de todos os workers, não só os do
+# worker que atendeu a coleta.
+
+# Funções de storage são bem mais rápidas que uma requisição inteira
+STORAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Infraestrutura de conexão/cache e utilitários sem acesso ao banco
+UNTIMED_STORAGE_FUNCTIONS = {
+    "get_backend", "get_conn", "release_conn", "close_conn", "get_db_connection",
+    "cache_stats", "clear_cache", "time_to_minutes", "generate_default_times",
+}
+
+REQUESTS = Counter("http_requests_total", "Requisições atendidas", ["method", "route", "status"])
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Tempo de resposta por rota", ["method", "route"])
+STORAGE_LATENCY = Histogram(
+    "storage_call_duration_seconds", "Chamadas e tempo das funções de storage.py (inclui chamadas internas)",
+    ["function"], buckets=STORAGE_BUCKETS,
+)
+STORAGE_ERRORS = Counter("storage_errors_total", "Exceções levantadas por funções de storage.py", ["function", "error"])
+DATABASE_LOCKED = Counter(
+    "storage_database_locked_total", "'database is locked' (busy_timeout do SQLite esgotado) por função", ["function"],
+)
+# Soma dos workers vivos; o cache de storage é por processo
+CACHE = Gauge("storage_cache", "storage.cache_stats() somado entre os workers", ["stat"], multiprocess_mode="livesum")
+
+
+def _timed(name, fn):
+    latency = STORAGE_LATENCY.labels(name)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as exc:
+            # Conta só na função onde a exceção surgiu, não em cada uma que ela atravessa
+            if not getattr(exc, "_metrics_counted", False):
+                exc._metrics_counted = True
+                STORAGE_ERRORS.labels(name, type(exc).__name__).inc()
+                if isinstance(exc, sqlite3.OperationalError) and "locked" in str(exc):
+                    DATABASE_LOCKED.labels(name).inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - t0)
+
+    wrapper._metrics_timed = True
+    return wrapper
+
+def instrument_storage(module):
+    # Troca as funções públicas do módulo por versões cronometradas. Chamadas
+    # entre funções do próprio módulo também passam a ser medidas, porque
+    # buscam o nome no módulo na hora da chamada.
+    for name, fn in list(vars(module).items()):
+        if name.startswith("_") or name in UNTIMED_STORAGE_FUNCTIONS:
+            continue
+        if not inspect.isfunction(fn) or fn.__module__ != module.__name__ or getattr(fn, "_metrics_timed", False):
+            continue
+        setattr(module, name, _timed(name, fn))
+
+def observe_request(method, route, status, seconds):
+    REQUESTS.labels(method, route, status).inc()
+    REQUEST_LATENCY.labels(method, route).observe(seconds)
+
+def set_cache_stats(stats):
+    for stat, value in stats.items():
+        CACHE.labels(stat).set(value)
+
+def render():
+    # (corpo, content type) da resposta de /metrics
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
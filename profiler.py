@@ -0,0 +1,78 @@
+import io
+import time
+import pstats
+import marshal
+import zipfile
+import cProfile
+from datetime import datetime
+
+import backends
+
+# Perfil de uma única requisição, pedido pelo admin (ver app.py). O resultado
+# é um .zip com:
+#   profile.pstats  cProfile no formato do pstats (snakeviz, flameprof, gprof2dot)
+#   profile.txt     funções ordenadas por tempo acumulado
+#   sql.txt         cada comando SQL executado, na ordem, com tempo e função
+#   request.txt     rota, status e totais
+
+PROFILE_TOP_FUNCTIONS = 80
+
+
+class RequestProfile:
+    def __init__(self, statements):
+        # Lista preenchida por backends.record_statement durante a requisição
+        self.statements = statements
+        self.elapsed = None
+        self._profiler = cProfile.Profile()
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._profiler.enable()
+
+    def stop(self):
+        # Chamado no after_request e de novo no teardown (se a resposta falhou)
+        if self._started is None or self.elapsed is not None:
+            return
+        self._profiler.disable()
+        self.elapsed = time.perf_counter() - self._started
+
+    def _stats_text(self):
+        out = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=out)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        return out.getvalue()
+
+    def _sql_text(self):
+        lines = []
+        total = 0.0
+        for i, (sql, params, seconds, caller) in enumerate(self.statements, 1):
+            total += seconds
+            if isinstance(params, list):
+                shape = backends.params_shape(params[0] if params else (), rows=len(params))
+            else:
+                shape = backends.params_shape(params)
+            lines.append(f"{i:4d} {seconds * 1000:9.3f} ms  {caller[0]}.{caller[1]}\n"
+                         f"     {backends.normalize_sql(sql)}\n     parâmetros: {shape}")
+        lines.append(f"{len(self.statements)} comandos, {total * 1000:.3f} ms no banco")
+        return "\n".join(lines) + "\n"
+
+    def to_zip(self, method, path, route, status):
+        self._profiler.create_stats()
+        sql_ms = sum(s[2] for s in self.statements) * 1000
+        info = (
+            f"{method} {path}\n"
+            f"rota: {route}\n"
+            f"status: {status}\n"
+            f"tempo total: {self.elapsed * 1000:.1f} ms\n"
+            f"comandos SQL: {len(self.statements)} ({sql_ms:.1f} ms)\n"
+            f"gerado em: {datetime.now().isoformat(' ', 'seconds')}\n"
+        )
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            # Mesmo formato de cProfile.Profile.dump_stats
+            zf.writestr("profile.pstats", marshal.dumps(self._profiler.stats))
+            zf.writestr("profile.txt", self._stats_text())
+            zf.writestr("sql.txt", self._sql_text())
+            zf.writestr("request.txt", info)
+        return buf.getvalue()
@@ -0,0 +1,249 @@
+-- Schema do backend PostgreSQL (DATABASE_URL=postgresql://...).
+-- Equivale ao resultado das migrações de storage.py (SCHEMA_VERSION) e pode
+-- ser reaplicado: storage._init_postgres executa este arquivo inteiro, dentro
+-- de uma transação, sempre que schema_version estiver atrasada.
+-- Colunas booleanas continuam INTEGER (0/1) como no SQLite.
+
+CREATE TABLE IF NOT EXISTS schema_version (
+  version INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS barbershops (
+  id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  name TEXT NOT NULL,
+  slug TEXT UNIQUE NOT NULL,
+  phone TEXT,
+  address TEXT,
+  active INTEGER DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS users (
+  id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  username TEXT UNIQUE NOT NULL,
+  password_hash TEXT NOT NULL,
+  role TEXT NOT NULL,
+  barbearia_nome TEXT,
+  phone TEXT,
+  barbershop_id INTEGER,
+  email TEXT
+);
+
+-- date_iso (YYYY-MM-DD) e minute_of_day (0-1439): no SQLite são mantidas por
+-- triggers, aqui são colunas geradas
+CREATE TABLE IF NOT EXISTS availability (
+  id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  day INTEGER NOT NULL,
+  time TEXT NOT NULL,
+  active INTEGER DEFAULT 1,
+  barber_id INTEGER,
+  month INTEGER,
+  year INTEGER,
+  barbershop_id INTEGER,
+  date_iso TEXT GENERATED ALWAYS AS (
+    CASE WHEN year IS NULL OR month IS NULL THEN NULL
+    ELSE lpad(year::text, 4, '0') || '-' || lpad(month::text, 2, '0') || '-' || lpad(day::text, 2, '0') END
+  ) STORED,
+  minute_of_day INTEGER GENERATED ALWAYS AS (
+    CASE WHEN strpos(time, ':') = 0 THEN NULL
+    ELSE split_part(time, ':', 1)::integer * 60 + split_part(time, ':', 2)::integer END
+  ) STORED
+);
+
+-- Sem FOREIGN KEY em user_id: o SQLite não aplica a do schema original e
+-- delete_barbershop apaga usuários que podem ter agendamentos em outra barbearia
+CREATE TABLE IF NOT EXISTS bookings (
+  id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  user_id INTEGER NOT NULL,
+  day INTEGER NOT NULL,
+  month INTEGER,
+  year INTEGER,
+  time TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'confirmado',
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  service TEXT DEFAULT 'corte de cabelo',
+  customer_phone TEXT,
+  customer_name TEXT,
+  barber_id INTEGER,
+  barbershop_id INTEGER,
+  service_id INTEGER,
+  price_cents INTEGER DEFAULT 0,
+  date_iso TEXT GENERATED ALWAYS AS (
+    CASE WHEN year IS NULL OR month IS NULL THEN NULL
+    ELSE lpad(year::text, 4, '0') || '-' || lpad(month::text, 2, '0') || '-' || lpad(day::text, 2, '0') END
+  ) STORED,
+  minute_of_day INTEGER GENERATED ALWAYS AS (
+    CASE WHEN strpos(time, ':') = 0 THEN NULL
+    ELSE split_part(time, ':', 1)::integer * 60 + split_part(time, ':', 2)::integer END
+  ) STORED
+);
+
+CREATE TABLE IF NOT EXISTS services (
+  id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  barber_id INTEGER NOT NULL,
+  barbershop_id INTEGER,
+  name TEXT NOT NULL,
+  price_cents INTEGER NOT NULL DEFAULT 0,
+  active INTEGER NOT NULL DEFAULT 1,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Modelo semanal de horários por barbeiro (weekday: 0=Segunda ... 6=Domingo)
+CREATE TABLE IF NOT EXISTS schedule_templates (
+  id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  barber_id INTEGER NOT NULL,
+  barbershop_id INTEGER,
+  weekday INTEGER NOT NULL,
+  time TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS booking_monthly_stats (
+  barber_id INTEGER NOT NULL,
+  barbershop_id INTEGER NOT NULL,
+  year INTEGER NOT NULL,
+  month INTEGER NOT NULL,
+  total_cortes INTEGER NOT NULL DEFAULT 0,
+  total_revenue INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (barber_id, barbershop_id, year, month)
+);
+
+CREATE TABLE IF NOT EXISTS calendar_versions (
+  barbershop_id INTEGER NOT NULL,
+  barber_id INTEGER NOT NULL,
+  year INTEGER NOT NULL,
+  month INTEGER NOT NULL,
+  version INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (barbershop_id, barber_id, year, month)
+);
+
+CREATE TABLE IF NOT EXISTS cache_generations (
+  name TEXT PRIMARY KEY,
+  generation INTEGER NOT NULL DEFAULT 0
+);
+INSERT INTO cache_generations(name, generation)
+VALUES ('barbershops', 0), ('users', 0), ('services', 0)
+ON CONFLICT DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS booking_services (
+  booking_id INTEGER NOT NULL,
+  service_id INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  price_cents INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (booking_id, service_id)
+);
+
+-- Índices (mesmos nomes e colunas de _migration_004_indexes)
+CREATE INDEX IF NOT EXISTS idx_services_barber ON services(barber_id, barbershop_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_templates_unique ON schedule_templates(barber_id, weekday, time);
+CREATE INDEX IF NOT EXISTS idx_bookings_shop_month ON bookings(barbershop_id, year, month);
+CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings(user_id, year DESC, month DESC, day DESC, time) WHERE status='confirmado';
+CREATE INDEX IF NOT EXISTS idx_users_shop ON users(barbershop_id);
+CREATE INDEX IF NOT EXISTS idx_barbershops_name ON barbershops(name, id);
+CREATE INDEX IF NOT EXISTS idx_users_role ON users(role, barbershop_id);
+CREATE INDEX IF NOT EXISTS idx_avail_shop ON availability(barbershop_id);
+CREATE INDEX IF NOT EXISTS idx_avail_date ON availability(year, month, day);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_avail_unique ON availability(day, month, year, time, barber_id, barbershop_id);
+CREATE INDEX IF NOT EXISTS idx_avail_owner_month ON availability(barber_id, barbershop_id, year, month, day, time);
+CREATE INDEX IF NOT EXISTS idx_bookings_barber_date ON bookings(barber_id, barbershop_id, date_iso, minute_of_day) WHERE status='confirmado';
+-- Um único agendamento confirmado por barbeiro/horário: dois create_booking
+-- concorrentes passam pelo NOT EXISTS, mas o segundo INSERT espera o commit do
+-- primeiro neste índice e falha com unique_violation
+CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_slot_unique ON bookings(barber_id, barbershop_id, year, month, day, time) WHERE status='confirmado';
+
+-- booking_monthly_stats: soma ou subtrai um agendamento confirmado (nulos viram 0)
+CREATE OR REPLACE FUNCTION booking_monthly_stats_delta(p_barber_id INTEGER, p_barbershop_id INTEGER, p_year INTEGER, p_month INTEGER, p_cortes INTEGER, p_revenue INTEGER)
+RETURNS void AS $$
+BEGIN
+  INSERT INTO booking_monthly_stats(barber_id, barbershop_id, year, month, total_cortes, total_revenue)
+  VALUES (COALESCE(p_barber_id, 0), COALESCE(p_barbershop_id, 0), COALESCE(p_year, 0), COALESCE(p_month, 0), p_cortes, p_revenue)
+  ON CONFLICT (barber_id, barbershop_id, year, month) DO UPDATE SET
+    total_cortes = booking_monthly_stats.total_cortes + excluded.total_cortes,
+    total_revenue = booking_monthly_stats.total_revenue + excluded.total_revenue;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_bookings_stats() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' AND OLD.status = 'confirmado' THEN
+    PERFORM booking_monthly_stats_delta(OLD.barber_id, OLD.barbershop_id, OLD.year, OLD.month, -1, -COALESCE(OLD.price_cents, 0));
+  END IF;
+  IF TG_OP <> 'DELETE' AND NEW.status = 'confirmado' THEN
+    PERFORM booking_monthly_stats_delta(NEW.barber_id, NEW.barbershop_id, NEW.year, NEW.month, 1, COALESCE(NEW.price_cents, 0));
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bookings_stats ON bookings;
+CREATE TRIGGER trg_bookings_stats
+AFTER INSERT OR DELETE OR UPDATE OF status, price_cents, barber_id, barbershop_id, year, month ON bookings
+FOR EACH ROW EXECUTE FUNCTION trg_bookings_stats();
+
+-- calendar_versions: versão do mês de um barbeiro (base dos ETags de /agenda e /horarios)
+CREATE OR REPLACE FUNCTION calendar_version_bump(p_barbershop_id INTEGER, p_barber_id INTEGER, p_year INTEGER, p_month INTEGER)
+RETURNS void AS $$
+BEGIN
+  INSERT INTO calendar_versions(barbershop_id, barber_id, year, month, version)
+  VALUES (COALESCE(p_barbershop_id, 0), COALESCE(p_barber_id, 0), COALESCE(p_year, 0), COALESCE(p_month, 0), 1)
+  ON CONFLICT (barbershop_id, barber_id, year, month) DO UPDATE SET version = calendar_versions.version + 1;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_calendar_version() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' THEN
+    PERFORM calendar_version_bump(OLD.barbershop_id, OLD.barber_id, OLD.year, OLD.month);
+  END IF;
+  IF TG_OP <> 'DELETE' THEN
+    PERFORM calendar_version_bump(NEW.barbershop_id, NEW.barber_id, NEW.year, NEW.month);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bookings_version ON bookings;
+CREATE TRIGGER trg_bookings_version
+AFTER INSERT OR DELETE OR UPDATE OF status, user_id, barber_id, barbershop_id, year, month, day, time, service, customer_name, customer_phone, price_cents ON bookings
+FOR EACH ROW EXECUTE FUNCTION trg_calendar_version();
+
+DROP TRIGGER IF EXISTS trg_availability_version ON availability;
+CREATE TRIGGER trg_availability_version
+AFTER INSERT OR DELETE OR UPDATE OF active, barber_id, barbershop_id, year, month, day, time ON availability
+FOR EACH ROW EXECUTE FUNCTION trg_calendar_version();
+
+-- Mudanças no modelo semanal valem para todos os meses: versão do barbeiro em (0, barber_id, 0, 0)
+CREATE OR REPLACE FUNCTION trg_templates_version() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' THEN
+    PERFORM calendar_version_bump(0, OLD.barber_id, 0, 0);
+  END IF;
+  IF TG_OP <> 'DELETE' THEN
+    PERFORM calendar_version_bump(0, NEW.barber_id, 0, 0);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_templates_version ON schedule_templates;
+CREATE TRIGGER trg_templates_version
+AFTER INSERT OR DELETE OR UPDATE ON schedule_templates
+FOR EACH ROW EXECUTE FUNCTION trg_templates_version();
+
+-- cache_generations: uma vez por comando (não por linha) nas tabelas em cache
+CREATE OR REPLACE FUNCTION trg_cache_generation() RETURNS trigger AS $$
+BEGIN
+  UPDATE cache_generations SET generation = generation + 1 WHERE name = TG_TABLE_NAME;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_barbershops_cache ON barbershops;
+CREATE TRIGGER trg_barbershops_cache AFTER INSERT OR UPDATE OR DELETE ON barbershops
+FOR EACH STATEMENT EXECUTE FUNCTION trg_cache_generation();
+
+DROP TRIGGER IF EXISTS trg_users_cache ON users;
+CREATE TRIGGER trg_users_cache AFTER INSERT OR UPDATE OR DELETE ON users
+FOR EACH STATEMENT EXECUTE FUNCTION trg_cache_generation();
+
+DROP TRIGGER IF EXISTS trg_services_cache ON services;
+CREATE TRIGGER trg_services_cache AFTER INSERT OR UPDATE OR DELETE ON services
+FOR EACH STATEMENT EXECUTE FUNCTION trg_cache_generation();
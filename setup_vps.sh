@@ -78,7 +78,7 @@ User=$USER_NAME
 Group=www-data
 WorkingDirectory=$APP_DIR
 Environment="PATH=$APP_DIR/.venv/bin"
-ExecStart=$APP_DIR/.venv/bin/gunicorn --workers 3 --bind unix:barber_calendar.sock -m 007 app:app
+ExecStart=$APP_DIR/.venv/bin/gunicorn -c gunicorn.conf.py --bind unix:barber_calendar.sock -m 007 app:app
 
 [Install]
 WantedBy=multi-user.target
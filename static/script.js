@@ -182,6 +182,44 @@ document.addEventListener("DOMContentLoaded", () => {
                     });
             });
         });
+
+        // Histórico paginado: cada clique busca a próxima janela a partir do cursor
+        document.querySelectorAll(".btn-carregar-agendamentos").forEach(btn => {
+            btn.addEventListener("click", () => {
+                const lista = document.getElementById(btn.dataset.alvo);
+                const params = new URLSearchParams({ [btn.dataset.direcao]: btn.dataset.cursor });
+                btn.disabled = true;
+                fetch(`/api/agendamentos?${params}`)
+                    .then(r => r.json())
+                    .then(data => {
+                        if (!data.success) {
+                            showToast('Erro ao carregar agendamentos.', 'error');
+                            btn.disabled = false;
+                            return;
+                        }
+                        data.agendamentos.forEach(a => {
+                            const dataFmt = `${String(a.day).padStart(2, '0')}/${String(a.month).padStart(2, '0')}/${a.year}`;
+                            const card = document.createElement("div");
+                            card.className = "appointment-card";
+                            card.innerHTML = `<div class="appointment-info"><span class="time">${dataFmt} ${a.time}</span><span class="client-name"></span></div>`
+                                + `<div class="appointment-actions"><span class="tag-service"></span></div>`;
+                            card.querySelector(".client-name").textContent = a.cliente;
+                            card.querySelector(".tag-service").textContent = a.service;
+                            if (lista) lista.appendChild(card);
+                        });
+                        if (data.next_cursor) {
+                            btn.dataset.cursor = data.next_cursor;
+                            btn.disabled = false;
+                        } else {
+                            btn.remove();
+                        }
+                    })
+                    .catch(() => {
+                        showToast('Erro de comunicação com o servidor.', 'error');
+                        btn.disabled = false;
+                    });
+            });
+        });
     }
 
     // --- Toast Function ---
@@ -1,13 +1,18 @@
 import os
-import sqlite3
-from datetime import datetime
+import calendar
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 
-def _db_path():
-    url = os.getenv("DATABASE_URL", "sqlite:///agenda.db")
-    if url.startswith("sqlite:///"):
-        return url.replace("sqlite:///", "")
-    return url
+import backends
+
+logger = logging.getLogger(__name__)
+
+def _database_url():
+    # sqlite:///arquivo.db ou postgresql://... (ver backends.py)
+    return os.getenv("DATABASE_URL", "sqlite:///agenda.db")
 
 def create_admin(username, password):
     conn = get_conn()
@@ -18,62 +23,203 @@ def create_admin(username, password):
         conn.close()
         return False
     
-    pwd_hash = generate_password_hash(password)
+    pwd_hash = hash_password(password)
     cur.execute(
         "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
         (username, pwd_hash, "admin")
     )
     conn.commit()
     conn.close()
+    _invalidate_cache("users")
     return True
 
-def get_all_barbershops_with_stats():
+def get_all_barbershops_with_stats(after_name=None, after_id=None, limit=None):
+    # Barbearias ordenadas por (nome, id) com o número de barbeiros e de
+    # agendamentos do mês atual, em uma única consulta.
+    # Paginação por keyset: passe o (nome, id) da última linha da página anterior.
+    # As contagens só são feitas para as barbearias da página.
+    now = datetime.now()
+
+    page_sql = "SELECT id, name, slug FROM barbershops"
+    params = []
+    if after_name is not None and after_id is not None:
+        page_sql += " WHERE (name, id) > (?, ?)"
+        params.extend([after_name, after_id])
+    page_sql += " ORDER BY name, id"
+    if limit is not None:
+        page_sql += " LIMIT ?"
+        params.append(limit)
+
+    sql = f"""
+        WITH page AS ({page_sql})
+        SELECT p.id, p.name, p.slug,
+               COALESCE(u.c, 0) AS barbers_count,
+               COALESCE(b.c, 0) AS bookings_count
+        FROM page p
+        LEFT JOIN (
+            SELECT barbershop_id, COUNT(*) c FROM users
+            WHERE role='barbeiro' AND barbershop_id IN (SELECT id FROM page)
+            GROUP BY barbershop_id
+        ) u ON u.barbershop_id = p.id
+        LEFT JOIN (
+            SELECT barbershop_id, COUNT(*) c FROM bookings
+            WHERE barbershop_id IN (SELECT id FROM page) AND year=? AND month=?
+            GROUP BY barbershop_id
+        ) b ON b.barbershop_id = p.id
+        ORDER BY p.name, p.id
+    """
+    params.extend([now.year, now.month])
+
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM barbershops")
-    shops = cur.fetchall()
-    
-    # Mês/Ano atual para filtro
-    now = datetime.now()
-    
-    results = []
-    for shop in shops:
-        sid = shop["id"]
-        # Count barbers
-        cur.execute("SELECT COUNT(*) c FROM users WHERE barbershop_id=? AND role='barbeiro'", (sid,))
-        barbers_count = cur.fetchone()["c"]
-        
-        # Count bookings (somente do mês atual)
-        cur.execute("SELECT COUNT(*) c FROM bookings WHERE barbershop_id=? AND month=? AND year=?", (sid, now.month, now.year))
-        bookings_count = cur.fetchone()["c"]
-        
-        results.append({
-            "id": sid,
-            "name": shop["name"],
-            "slug": shop["slug"],
-            "barbers_count": barbers_count,
-            "bookings_count": bookings_count
-        })
+    cur.execute(sql, tuple(params))
+    results = [dict(r) for r in cur.fetchall()]
     conn.close()
     return results
 
-def get_conn():
-    p = _db_path()
-    conn = sqlite3.connect(p, detect_types=sqlite3.PARSE_DECLTYPES)
-    conn.row_factory = sqlite3.Row
-    return conn
+def count_barbershops():
+    # Total do painel do admin: relido só quando barbershops muda
+    return _cached("barbershops", ("count_barbershops",), _count_barbershops)
 
-def migrate_legacy_data():
+def _count_barbershops():
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE username='barbeiro'")
-    row = cur.fetchone()
-    if row:
-        uid = row["id"]
-        cur.execute("UPDATE availability SET barber_id=? WHERE barber_id IS NULL", (uid,))
-        cur.execute("UPDATE bookings SET barber_id=? WHERE barber_id IS NULL", (uid,))
-        conn.commit()
+    cur.execute("SELECT COUNT(*) c FROM barbershops")
+    c = cur.fetchone()["c"]
     conn.close()
+    return c
+
+_local = threading.local()
+
+def get_backend():
+    return backends.get_backend(_database_url())
+
+def get_conn():
+    # SQLite: uma conexão por thread (e por processo: após o fork do gunicorn
+    # cada worker abre a sua). PostgreSQL: a thread pega uma conexão do pool
+    # na primeira chamada e a devolve em release_conn.
+    backend = get_backend()
+    key = (os.getpid(), backend.url)
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.key == key:
+        return conn
+    if conn is not None and _local.key[0] == key[0]:
+        _local.backend.discard(conn)
+    conn = backend.connect()
+    _local.conn = conn
+    _local.key = key
+    _local.backend = backend
+    return conn
+
+def release_conn():
+    # Chamado no teardown de cada request: garante que nenhuma transação fique aberta
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.key[0] == os.getpid():
+        _local.backend.release(conn)
+        if not _local.backend.per_thread:
+            _local.conn = None
+            _local.key = None
+
+def _begin_immediate(conn, cur):
+    # Abre a transação de escrita. Uma transação pendente aqui é um erro de quem
+    # chamou (a conexão é compartilhada pela thread): desfaz em vez de confirmar
+    # trabalho pela metade junto com o nosso.
+    if conn.in_transaction:
+        conn.rollback()
+        raise RuntimeError("transação pendente na conexão antes de BEGIN IMMEDIATE")
+    cur.execute("BEGIN IMMEDIATE")
+
+def close_conn():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.key[0] == os.getpid():
+        _local.backend.discard(conn)
+    _local.conn = None
+    _local.key = None
+
+# === Cache de leitura (barbearias, usuários, serviços) ===
+# LRU por processo para consultas que quase nunca mudam. Cada entrada pertence
+# a uma tabela; as funções que escrevem nessa tabela chamam _invalidate_cache
+# depois do commit. Escritas de outros workers chegam pela tabela
+# cache_generations (incrementada por triggers): a cada leitura, se
+# PRAGMA data_version indicar commit de outra conexão (no PostgreSQL, uma vez
+# por request), as gerações são relidas e as tabelas que mudaram são descartadas.
+STORAGE_CACHE_SIZE = int(os.getenv("STORAGE_CACHE_SIZE", "1024"))
+CACHED_TABLES = ("barbershops", "users", "services")
+
+_cache_lock = threading.Lock()
+_cache_entries = OrderedDict()  # (tabela, função, args) -> resultado
+_cache_epochs = dict.fromkeys(CACHED_TABLES, 0)  # invalidações locais por tabela
+_cache_generations = {}  # última leitura de cache_generations
+_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+def _drop_cached(*tables):
+    with _cache_lock:
+        for key in [k for k in _cache_entries if k[0] in tables]:
+            del _cache_entries[key]
+        for table in tables:
+            _cache_epochs[table] += 1
+        _cache_stats["invalidations"] += 1
+
+def _read_cache_generations(conn):
+    rows = conn.execute("SELECT name, generation FROM cache_generations").fetchall()
+    return {r["name"]: r["generation"] for r in rows}
+
+def _invalidate_cache(*tables):
+    # Chamado após o commit de uma escrita deste processo. As gerações são lidas
+    # antes de limpar para que a própria escrita não pareça, mais tarde, uma
+    # escrita de outro worker (o que limparia o cache uma segunda vez).
+    generations = _read_cache_generations(get_conn())
+    _drop_cached(*tables)
+    for table in tables:
+        _cache_generations[table] = generations.get(table)
+
+def _sync_cache_generations(conn):
+    # data_version só muda quando outra conexão faz commit; total_changes cobre
+    # as escritas desta conexão que não passam por _invalidate_cache (ex.: o
+    # cadastro de barbearia em app.py)
+    data_version = (get_backend().data_version(conn), conn.total_changes)
+    if getattr(conn, "seen_data_version", None) == data_version:
+        return
+    generations = _read_cache_generations(conn)
+    conn.seen_data_version = data_version
+    changed = [t for t in CACHED_TABLES if generations.get(t) != _cache_generations.get(t)]
+    if changed:
+        _drop_cached(*changed)
+        for table in changed:
+            _cache_generations[table] = generations.get(table)
+
+def _cached(table, key, loader):
+    if STORAGE_CACHE_SIZE <= 0:
+        return loader()
+    _sync_cache_generations(get_conn())
+    full_key = (table,) + key
+    with _cache_lock:
+        if full_key in _cache_entries:
+            _cache_entries.move_to_end(full_key)
+            _cache_stats["hits"] += 1
+            return _cache_entries[full_key]
+        _cache_stats["misses"] += 1
+        epoch = _cache_epochs[table]
+    value = loader()
+    # Resultados vazios não são guardados: um INSERT feito fora deste módulo
+    # (ex.: nova barbearia) nunca fica escondido por um "não encontrado".
+    if not value:
+        return value
+    with _cache_lock:
+        # Se houve invalidação durante a leitura, o valor pode estar velho
+        if _cache_epochs[table] == epoch:
+            _cache_entries[full_key] = value
+            if len(_cache_entries) > STORAGE_CACHE_SIZE:
+                _cache_entries.popitem(last=False)
+                _cache_stats["evictions"] += 1
+    return value
+
+def cache_stats():
+    with _cache_lock:
+        return dict(_cache_stats, size=len(_cache_entries), max_size=STORAGE_CACHE_SIZE)
+
+def clear_cache():
+    _drop_cached(*CACHED_TABLES)
 
 def get_default_barber_id():
     conn = get_conn()
@@ -89,19 +235,85 @@ def get_default_barber_id():
     conn.close()
     return row["id"] if row else None
 
-def init_db():
+# Expressões SQL usadas pelos triggers (row = NEW ou o nome da tabela)
+DATE_ISO_SQL = (
+    "CASE WHEN {row}.year IS NULL OR {row}.month IS NULL THEN NULL "
+    "ELSE printf('%04d-%02d-%02d', {row}.year, {row}.month, {row}.day) END"
+)
+MINUTE_OF_DAY_SQL = (
+    "CASE WHEN instr({row}.time, ':') = 0 THEN NULL "
+    "ELSE CAST(substr({row}.time, 1, instr({row}.time, ':') - 1) AS INTEGER) * 60"
+    " + CAST(substr({row}.time, instr({row}.time, ':') + 1) AS INTEGER) END"
+)
+
+# Soma (sign="") ou subtrai (sign="-") um agendamento de booking_monthly_stats
+MONTHLY_STATS_DELTA_SQL = """
+    INSERT INTO booking_monthly_stats(barber_id, barbershop_id, year, month, total_cortes, total_revenue)
+    SELECT COALESCE({row}.barber_id, 0), COALESCE({row}.barbershop_id, 0), COALESCE({row}.year, 0), COALESCE({row}.month, 0),
+           {sign}1, {sign}COALESCE({row}.price_cents, 0)
+    WHERE {row}.status='confirmado'
+    ON CONFLICT(barber_id, barbershop_id, year, month) DO UPDATE SET
+        total_cortes = total_cortes + excluded.total_cortes,
+        total_revenue = total_revenue + excluded.total_revenue;
+"""
+
+def _rebuild_monthly_stats(cur):
+    cur.execute("DELETE FROM booking_monthly_stats")
+    cur.execute("""
+        INSERT INTO booking_monthly_stats(barber_id, barbershop_id, year, month, total_cortes, total_revenue)
+        SELECT COALESCE(barber_id, 0), COALESCE(barbershop_id, 0), COALESCE(year, 0), COALESCE(month, 0),
+               COUNT(*), COALESCE(SUM(price_cents), 0)
+        FROM bookings
+        WHERE status='confirmado'
+        GROUP BY 1, 2, 3, 4
+    """)
+
+def rebuild_monthly_stats():
+    # Recalcula booking_monthly_stats a partir de bookings (correção manual / após importações)
     conn = get_conn()
     cur = conn.cursor()
+    _begin_immediate(conn, cur)
+    _rebuild_monthly_stats(cur)
+    conn.commit()
+    conn.close()
+
+def time_to_minutes(t):
+    # "HH:MM" -> minutos desde a meia-noite
+    h, m = t.split(":")
+    return int(h) * 60 + int(m)
+
+# === Migrações de schema ===
+# Cada migração recebe o cursor de uma transação já aberta (BEGIN IMMEDIATE)
+# e não pode fazer commit: init_db grava PRAGMA user_version com o número da
+# última aplicada no mesmo commit. Bancos anteriores a este controle estão na
+# versão 0 com qualquer parte do schema já criada, por isso as migrações
+# verificam o que já existe antes de alterar.
+# Para mudar o schema, acrescente uma nova função ao final de MIGRATIONS e
+# reflita a mudança em schema_postgres.sql (ver _init_postgres).
+
+def _table_columns(cur, table):
+    cur.execute(f"PRAGMA table_info({table})")
+    return [r["name"] for r in cur.fetchall()]
+
+def _table_exists(cur, table):
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    return cur.fetchone() is not None
+
+def _migration_001_base(cur):
+    # Tabelas originais (migrations.sql), colunas acrescentadas depois e dados padrão
     here = os.path.dirname(__file__)
     sql_path = os.path.join(here, "migrations.sql")
     with open(sql_path, "r", encoding="utf-8") as f:
-        cur.executescript(f.read())
-    conn.commit()
-    cur.execute("PRAGMA table_info(bookings)")
-    cols = [r["name"] for r in cur.fetchall()]
+        script = f.read()
+    # executescript faria COMMIT; o BEGIN/COMMIT do arquivo é ignorado
+    for stmt in script.split(";"):
+        stmt = stmt.strip()
+        if stmt and stmt.upper() not in ("BEGIN", "COMMIT"):
+            cur.execute(stmt)
+
+    cols = _table_columns(cur, "bookings")
     if "service" not in cols:
         cur.execute("ALTER TABLE bookings ADD COLUMN service TEXT DEFAULT 'corte de cabelo'")
-        conn.commit()
     if "year" not in cols:
         cur.execute("ALTER TABLE bookings ADD COLUMN year INTEGER")
     if "month" not in cols:
@@ -119,8 +331,7 @@ def init_db():
     if "price_cents" not in cols:
         cur.execute("ALTER TABLE bookings ADD COLUMN price_cents INTEGER DEFAULT 0")
 
-    cur.execute("PRAGMA table_info(availability)")
-    acols = [r["name"] for r in cur.fetchall()]
+    acols = _table_columns(cur, "availability")
     if "barber_id" not in acols:
         cur.execute("ALTER TABLE availability ADD COLUMN barber_id INTEGER")
     if "month" not in acols:
@@ -141,10 +352,8 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
-
     cur.execute("CREATE INDEX IF NOT EXISTS idx_services_barber ON services(barber_id, barbershop_id)")
 
-    # Criar tabela barbershops se não existir
     cur.execute("""
         CREATE TABLE IF NOT EXISTS barbershops (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -154,10 +363,7 @@ def init_db():
             address TEXT
         )
     """)
-    
-    # Garantir colunas na tabela barbershops (migração)
-    cur.execute("PRAGMA table_info(barbershops)")
-    bcols = [r["name"] for r in cur.fetchall()]
+    bcols = _table_columns(cur, "barbershops")
     if "phone" not in bcols:
         cur.execute("ALTER TABLE barbershops ADD COLUMN phone TEXT")
     if "address" not in bcols:
@@ -165,8 +371,7 @@ def init_db():
     if "active" not in bcols:
         cur.execute("ALTER TABLE barbershops ADD COLUMN active INTEGER DEFAULT 1")
 
-    cur.execute("PRAGMA table_info(users)")
-    ucols = [r["name"] for r in cur.fetchall()]
+    ucols = _table_columns(cur, "users")
     if "barbearia_nome" not in ucols:
         cur.execute("ALTER TABLE users ADD COLUMN barbearia_nome TEXT")
     if "phone" not in ucols:
@@ -176,52 +381,422 @@ def init_db():
     if "email" not in ucols:
         cur.execute("ALTER TABLE users ADD COLUMN email TEXT")
 
-    # Indices para performance com muitas barbearias
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_bookings_shop ON bookings(barbershop_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_shop ON users(barbershop_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_avail_shop ON availability(barbershop_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_avail_date ON availability(year, month, day)")
-    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_avail_unique ON availability(day, month, year, time, barber_id, barbershop_id)")
+    _create_default_barbershop(cur)
+
+    if ("year" not in cols) or ("month" not in cols):
+        now = datetime.now()
+        cur.execute("UPDATE bookings SET year=? WHERE year IS NULL", (now.year,))
+        cur.execute("UPDATE bookings SET month=? WHERE month IS NULL", (now.month,))
+
+    # Dados da versão com um único barbeiro ("barbeiro") passam a ser dele
+    cur.execute("SELECT id FROM users WHERE username='barbeiro'")
+    row = cur.fetchone()
+    if row:
+        cur.execute("UPDATE availability SET barber_id=? WHERE barber_id IS NULL", (row["id"],))
+        cur.execute("UPDATE bookings SET barber_id=? WHERE barber_id IS NULL", (row["id"],))
+
+    _create_default_admin(cur)
 
+def _create_default_barbershop(cur):
     # Criar barbearia padrão se não existir
     cur.execute("SELECT COUNT(*) c FROM barbershops")
     if cur.fetchone()["c"] == 0:
-        cur.execute("INSERT INTO barbershops (name, slug, phone) VALUES (?, ?, ?)", 
+        cur.execute("INSERT INTO barbershops (name, slug, phone) VALUES (?, ?, ?)",
                    ("Minha Barbearia", "minha-barbearia", "00000000000"))
         bs_id = cur.lastrowid
         # Migrar dados existentes para a barbearia padrão
         cur.execute("UPDATE users SET barbershop_id=? WHERE barbershop_id IS NULL", (bs_id,))
         cur.execute("UPDATE bookings SET barbershop_id=? WHERE barbershop_id IS NULL", (bs_id,))
         cur.execute("UPDATE availability SET barbershop_id=? WHERE barbershop_id IS NULL", (bs_id,))
-        conn.commit()
 
-    if ("year" not in cols) or ("month" not in cols):
-        now = datetime.now()
-        cur.execute("UPDATE bookings SET year=? WHERE year IS NULL", (now.year,))
-        cur.execute("UPDATE bookings SET month=? WHERE month IS NULL", (now.month,))
-        conn.commit()
-    
+def _create_default_admin(cur):
     # Criar admin padrão se não existir
     cur.execute("SELECT COUNT(*) c FROM users WHERE role='admin'")
     if cur.fetchone()["c"] == 0:
-        pwd_hash = generate_password_hash("admin123")
+        pwd_hash = generate_password_hash("admin123", PASSWORD_HASH_METHOD)
         cur.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)", ("admin", pwd_hash, "admin"))
-        conn.commit()
 
+def _migration_002_date_columns(cur):
+    # Data ISO (YYYY-MM-DD) e minuto do dia (0-1439) espelhando day/month/year/time,
+    # para consultas por intervalo em um único range scan de índice.
+    # Os triggers mantêm as colunas em sincronia em qualquer INSERT/UPDATE.
+    for table in ("bookings", "availability"):
+        tcols = _table_columns(cur, table)
+        if "date_iso" not in tcols:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN date_iso TEXT")
+        if "minute_of_day" not in tcols:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN minute_of_day INTEGER")
+        date_sql = DATE_ISO_SQL.format(row="NEW")
+        minute_sql = MINUTE_OF_DAY_SQL.format(row="NEW")
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_dates_ins AFTER INSERT ON {table}
+            BEGIN
+                UPDATE {table} SET date_iso = {date_sql}, minute_of_day = {minute_sql} WHERE id = NEW.id;
+            END
+        """)
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_dates_upd AFTER UPDATE OF day, month, year, time ON {table}
+            BEGIN
+                UPDATE {table} SET date_iso = {date_sql}, minute_of_day = {minute_sql} WHERE id = NEW.id;
+            END
+        """)
+        if "date_iso" not in tcols:
+            cur.execute(f"""
+                UPDATE {table} SET date_iso = {DATE_ISO_SQL.format(row=table)},
+                                   minute_of_day = {MINUTE_OF_DAY_SQL.format(row=table)}
+            """)
+
+def _migration_003_schedule_templates(cur):
+    # Modelo semanal de horários por barbeiro (weekday: 0=Segunda ... 6=Domingo)
+    had_templates = _table_exists(cur, "schedule_templates")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schedule_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            barber_id INTEGER NOT NULL,
+            barbershop_id INTEGER,
+            weekday INTEGER NOT NULL,
+            time TEXT NOT NULL
+        )
+    """)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_templates_unique ON schedule_templates(barber_id, weekday, time)")
+    if not had_templates:
+        _compact_availability(cur)
+
+def _migration_004_indexes(cur):
+    # Indices para performance com muitas barbearias.
+    # Cada índice segue os filtros/ordenação de uma consulta deste módulo
+    # (ver tests/test_query_plans.py, que falha se alguma consulta fizer table scan).
+    cur.execute("DROP INDEX IF EXISTS idx_bookings_shop")
+    # admin (contagem do mês por barbearia) e delete_barbershop
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_bookings_shop_month ON bookings(barbershop_id, year, month)")
+    # get_bookings_by_user: confirmados do usuário, mais recentes primeiro
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings(user_id, year DESC, month DESC, day DESC, time) WHERE status='confirmado'")
+    # get_monthly_stats_for_barber agora lê booking_monthly_stats
+    cur.execute("DROP INDEX IF EXISTS idx_bookings_barber_month")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_shop ON users(barbershop_id)")
+    # Paginação do painel admin por (nome, id)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_barbershops_name ON barbershops(name, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_role ON users(role, barbershop_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_avail_shop ON availability(barbershop_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_avail_date ON availability(year, month, day)")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_avail_unique ON availability(day, month, year, time, barber_id, barbershop_id)")
+    # get_month_availability: exceções do mês de um barbeiro
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_avail_owner_month ON availability(barber_id, barbershop_id, year, month, day, time)")
+    # get_bookings_between / get_bookings_page: janelas por data
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_bookings_barber_date ON bookings(barber_id, barbershop_id, date_iso, minute_of_day) WHERE status='confirmado'")
+    _create_slot_unique_index(cur)
+
+def _create_slot_unique_index(cur):
+    # Um único agendamento confirmado por barbeiro/horário; o mesmo índice atende
+    # disponibilidade, is_slot_taken e as listas por dia. Se já houver horários
+    # reservados em duplicidade, um índice comum com as mesmas colunas é usado
+    # até que sejam resolvidos e `flask slot-index` seja executado.
+    # SAVEPOINT: no PostgreSQL o erro invalidaria a transação inteira
+    cur.execute("SAVEPOINT slot_index")
+    try:
+        cur.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_slot_unique "
+            "ON bookings(barber_id, barbershop_id, year, month, day, time) WHERE status='confirmado'"
+        )
+        cur.execute("RELEASE SAVEPOINT slot_index")
+        cur.execute("DROP INDEX IF EXISTS idx_bookings_slot")
+        return True
+    except backends.INTEGRITY_ERRORS:
+        cur.execute("ROLLBACK TO SAVEPOINT slot_index")
+        cur.execute("RELEASE SAVEPOINT slot_index")
+        logger.warning("idx_bookings_slot_unique não criado: existem agendamentos confirmados em duplicidade")
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_bookings_slot "
+            "ON bookings(barber_id, barbershop_id, year, month, day, time) WHERE status='confirmado'"
+        )
+        return False
+
+def create_slot_unique_index():
+    conn = get_conn()
+    cur = conn.cursor()
+    _begin_immediate(conn, cur)
+    created = _create_slot_unique_index(cur)
+    conn.commit()
     conn.close()
-    
-    # Run migration in a separate connection to avoid locking issues if any
-    migrate_legacy_data()
-    
+    return created
+
+def _migration_005_monthly_stats(cur):
+    # Totais mensais por barbeiro/barbearia (tela /financeiro), mantidos pelos
+    # triggers abaixo a cada INSERT/UPDATE/DELETE em bookings.
+    # barber_id/barbershop_id/year/month nulos são gravados como 0.
+    had_monthly_stats = _table_exists(cur, "booking_monthly_stats")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS booking_monthly_stats (
+            barber_id INTEGER NOT NULL,
+            barbershop_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            total_cortes INTEGER NOT NULL DEFAULT 0,
+            total_revenue INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (barber_id, barbershop_id, year, month)
+        )
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_stats_ins AFTER INSERT ON bookings
+        WHEN NEW.status='confirmado'
+        BEGIN
+            {MONTHLY_STATS_DELTA_SQL.format(row="NEW", sign="")}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_stats_del AFTER DELETE ON bookings
+        WHEN OLD.status='confirmado'
+        BEGIN
+            {MONTHLY_STATS_DELTA_SQL.format(row="OLD", sign="-")}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_stats_upd
+        AFTER UPDATE OF status, price_cents, barber_id, barbershop_id, year, month ON bookings
+        BEGIN
+            {MONTHLY_STATS_DELTA_SQL.format(row="OLD", sign="-")}
+            {MONTHLY_STATS_DELTA_SQL.format(row="NEW", sign="")}
+        END
+    """)
+    if not had_monthly_stats:
+        _rebuild_monthly_stats(cur)
+
+# Incrementa a versão do mês de um barbeiro (row = NEW ou OLD); nulos viram 0
+CALENDAR_VERSION_BUMP_SQL = """
+    INSERT INTO calendar_versions(barbershop_id, barber_id, year, month, version)
+    VALUES (COALESCE({row}.barbershop_id, 0), COALESCE({row}.barber_id, 0), COALESCE({row}.year, 0), COALESCE({row}.month, 0), 1)
+    ON CONFLICT(barbershop_id, barber_id, year, month) DO UPDATE SET version = version + 1;
+"""
+# Mudanças no modelo semanal valem para todos os meses: versão do barbeiro em (0, barber_id, 0, 0)
+TEMPLATE_VERSION_BUMP_SQL = """
+    INSERT INTO calendar_versions(barbershop_id, barber_id, year, month, version)
+    VALUES (0, {row}.barber_id, 0, 0, 1)
+    ON CONFLICT(barbershop_id, barber_id, year, month) DO UPDATE SET version = version + 1;
+"""
+# Colunas que mudam o que /horarios, /agenda e o painel mostram
+# (date_iso/minute_of_day ficam de fora: são recalculadas pelos próprios triggers)
+CALENDAR_BOOKING_COLUMNS = "status, user_id, barber_id, barbershop_id, year, month, day, time, service, customer_name, customer_phone, price_cents"
+CALENDAR_AVAILABILITY_COLUMNS = "active, barber_id, barbershop_id, year, month, day, time"
+
+def _migration_006_calendar_versions(cur):
+    # Contador por (barbearia, barbeiro, ano, mês) incrementado por triggers em
+    # qualquer escrita em bookings/availability; é a base dos ETags das telas
+    # de calendário e de /horarios (ver get_calendar_version).
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS calendar_versions (
+            barbershop_id INTEGER NOT NULL,
+            barber_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (barbershop_id, barber_id, year, month)
+        ) WITHOUT ROWID
+    """)
+    for table, columns in (("bookings", CALENDAR_BOOKING_COLUMNS), ("availability", CALENDAR_AVAILABILITY_COLUMNS)):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_version_ins AFTER INSERT ON {table}
+            BEGIN
+                {CALENDAR_VERSION_BUMP_SQL.format(row="NEW")}
+            END
+        """)
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_version_del AFTER DELETE ON {table}
+            BEGIN
+                {CALENDAR_VERSION_BUMP_SQL.format(row="OLD")}
+            END
+        """)
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_version_upd AFTER UPDATE OF {columns} ON {table}
+            BEGIN
+                {CALENDAR_VERSION_BUMP_SQL.format(row="OLD")}
+                {CALENDAR_VERSION_BUMP_SQL.format(row="NEW")}
+            END
+        """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_templates_version_ins AFTER INSERT ON schedule_templates
+        BEGIN
+            {TEMPLATE_VERSION_BUMP_SQL.format(row="NEW")}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_templates_version_del AFTER DELETE ON schedule_templates
+        BEGIN
+            {TEMPLATE_VERSION_BUMP_SQL.format(row="OLD")}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_templates_version_upd AFTER UPDATE ON schedule_templates
+        BEGIN
+            {TEMPLATE_VERSION_BUMP_SQL.format(row="OLD")}
+            {TEMPLATE_VERSION_BUMP_SQL.format(row="NEW")}
+        END
+    """)
+
+def _migration_007_cache_generations(cur):
+    # Geração por tabela em cache; os triggers incrementam a cada escrita para
+    # que os outros workers descartem o que têm em memória (ver _cached).
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS cache_generations (
+            name TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    for table in CACHED_TABLES:
+        cur.execute("INSERT OR IGNORE INTO cache_generations(name, generation) VALUES (?, 0)", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_cache_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE cache_generations SET generation = generation + 1 WHERE name='{table}';
+                END
+            """)
+
+def _migration_008_booking_services(cur):
+    # Serviços escolhidos em cada agendamento, com nome e preço do momento da reserva
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS booking_services (
+            booking_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            price_cents INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (booking_id, service_id)
+        ) WITHOUT ROWID
+    """)
+
+# Ordem de aplicação; a versão do schema é o número de migrações aplicadas
+MIGRATIONS = [
+    _migration_001_base,
+    _migration_002_date_columns,
+    _migration_003_schedule_templates,
+    _migration_004_indexes,
+    _migration_005_monthly_stats,
+    _migration_006_calendar_versions,
+    _migration_007_cache_generations,
+    _migration_008_booking_services,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Quanto um worker espera pelo lock enquanto outro processo aplica migrações
+MIGRATION_LOCK_TIMEOUT_MS = int(os.getenv("MIGRATION_LOCK_TIMEOUT_MS", "300000"))
+
+# Chave do pg_advisory_xact_lock que serializa o init_db no PostgreSQL
+PG_MIGRATION_LOCK_KEY = 7281001
+
+def _pg_schema_version(conn):
+    if not conn.execute("SELECT to_regclass('schema_version') IS NOT NULL").fetchone()[0]:
+        return 0
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def schema_version():
+    conn = get_conn()
+    if get_backend().name == "postgres":
+        version = _pg_schema_version(conn)
+    else:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+    return version
+
+def _init_postgres():
+    # O PostgreSQL não passa pelas migrações acima: schema_postgres.sql descreve
+    # o schema atual inteiro, pode ser reaplicado e é executado quando a versão
+    # gravada em schema_version é menor que SCHEMA_VERSION. Toda nova migração
+    # precisa ser refletida nesse arquivo.
     conn = get_conn()
+    if _pg_schema_version(conn) >= SCHEMA_VERSION:
+        return
+    with open(os.path.join(os.path.dirname(__file__), "schema_postgres.sql"), "r", encoding="utf-8") as f:
+        script = f.read()
     cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) c FROM availability")
-    if cur.fetchone()["c"] == 0:
-        # Se não tem nada, seed default (talvez para um barbeiro criado agora?)
-        # Mas seed_default_availability não recebe barber_id...
-        # Vamos deixar quieto por enquanto, create_user cuida disso.
-        # Ou se for o primeiro run limpo:
-        pass 
+    try:
+        cur.execute("BEGIN")
+        # Lock até o fim da transação: os outros workers esperam aqui e, ao
+        # entrar, relêem a versão e encontram o schema já criado.
+        cur.execute("SELECT pg_advisory_xact_lock(?)", (PG_MIGRATION_LOCK_KEY,))
+        if _pg_schema_version(conn) < SCHEMA_VERSION:
+            logger.info("Aplicando schema_postgres.sql (versão %d)", SCHEMA_VERSION)
+            conn.executescript(script)
+            _create_default_barbershop(cur)
+            _create_default_admin(cur)
+            cur.execute("DELETE FROM schema_version")
+            cur.execute("INSERT INTO schema_version(version) VALUES (?)", (SCHEMA_VERSION,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def init_db():
+    # Chamado na inicialização de cada worker. Com o schema atualizado custa
+    # uma única leitura de PRAGMA user_version.
+    if get_backend().name == "postgres":
+        _init_postgres()
+        return
+    conn = get_conn()
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+
+    # BEGIN IMMEDIATE é o lock: os outros workers esperam aqui e, ao entrar,
+    # relêem a versão e encontram o schema já migrado.
+    conn.execute(f"PRAGMA busy_timeout={MIGRATION_LOCK_TIMEOUT_MS}")
+    cur = conn.cursor()
+    try:
+        _begin_immediate(conn, cur)
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        for number in range(version + 1, SCHEMA_VERSION + 1):
+            logger.info("Aplicando migração %d/%d", number, SCHEMA_VERSION)
+            MIGRATIONS[number - 1](cur)
+            # user_version fica no cabeçalho do banco e é gravado no mesmo commit
+            cur.execute(f"PRAGMA user_version={number}")
+        conn.commit()
+    finally:
+        conn.close()
+        conn.execute(f"PRAGMA busy_timeout={dict(backends.SQLITE_PRAGMAS)['busy_timeout']}")
+
+# Dia da semana (0=Segunda ... 6=Domingo) de year/month/day em cada banco
+WEEKDAY_SQL = {
+    "sqlite": "(CAST(strftime('%w', printf('%04d-%02d-%02d', {row}.year, {row}.month, {row}.day)) AS INTEGER) + 6) % 7",
+    "postgres": "CAST(EXTRACT(ISODOW FROM make_date({row}.year, {row}.month, {row}.day)) AS INTEGER) - 1",
+}
+
+def _compact_availability(cur):
+    # Migração para o modelo semanal: garante um modelo para cada barbeiro e
+    # apaga as linhas de availability que só repetiam o modelo (ativas e no
+    # mesmo horário), as duplicadas e as linhas antigas sem mês/ano que nunca
+    # eram lidas.
+    cur.execute("""
+        SELECT u.id, u.barbershop_id FROM users u
+        WHERE u.role='barbeiro'
+          AND NOT EXISTS (SELECT 1 FROM schedule_templates t WHERE t.barber_id=u.id)
+    """)
+    default_times = generate_default_times()
+    rows = []
+    for b in cur.fetchall():
+        rows.extend(_template_rows(b["id"], b["barbershop_id"], default_times))
+    cur.executemany("INSERT OR IGNORE INTO schedule_templates(barber_id,barbershop_id,weekday,time) VALUES(?,?,?,?)", rows)
+
+    cur.execute("DELETE FROM availability WHERE month IS NULL OR year IS NULL")
+    cur.execute("""
+        DELETE FROM availability WHERE id NOT IN (
+            SELECT MAX(id) FROM availability GROUP BY day, month, year, time, barber_id, barbershop_id
+        )
+    """)
+    weekday_sql = WEEKDAY_SQL[get_backend().name].format(row="a")
+    cur.execute(f"""
+        DELETE FROM availability WHERE id IN (
+            SELECT a.id FROM availability a
+            JOIN schedule_templates t
+              ON t.barber_id = a.barber_id
+             AND t.time = a.time
+             AND t.weekday = {weekday_sql}
+            WHERE a.active = 1
+        )
+    """)
+
+def compact_availability():
+    conn = get_conn()
+    cur = conn.cursor()
+    _begin_immediate(conn, cur)
+    _compact_availability(cur)
+    conn.commit()
     conn.close()
 
 def generate_default_times():
@@ -237,21 +812,48 @@ def generate_default_times():
         times.append(f"{h:02d}:30")
     return times
 
-def seed_default_availability(conn):
-    times = generate_default_times()
+def _template_rows(barber_id, barbershop_id, times):
+    return [(barber_id, barbershop_id, weekday, t) for weekday in range(7) for t in times]
+
+def seed_barbershop(shop_id):
+    # Onboarding de uma barbearia em uma única transação: grava o modelo semanal
+    # padrão dos barbeiros que ainda não têm um. availability continua só com
+    # exceções, então edições futuras do modelo valem para todos os dias.
+    # Retorna quantos barbeiros receberam o modelo.
+    conn = get_conn()
     cur = conn.cursor()
-    # Cria disponibilidade para dias 1 a 31
-    for day in range(1,32):
-        for t in times:
-            cur.execute("INSERT INTO availability(day,time,active) VALUES(?,?,1)", (day,t))
-    conn.commit()
+    cur.execute("SELECT id FROM users WHERE barbershop_id=? AND role='barbeiro'", (shop_id,))
+    barber_ids = [r["id"] for r in cur.fetchall()]
+    if not barber_ids:
+        conn.close()
+        return 0
+
+    marks = ",".join("?" for _ in barber_ids)
+    cur.execute(f"SELECT DISTINCT barber_id FROM schedule_templates WHERE barber_id IN ({marks})", tuple(barber_ids))
+    with_template = {r["barber_id"] for r in cur.fetchall()}
+    missing = [bid for bid in barber_ids if bid not in with_template]
+    if not missing:
+        conn.close()
+        return 0
+    default_times = generate_default_times()
+    template_rows = []
+    for bid in missing:
+        template_rows.extend(_template_rows(bid, shop_id, default_times))
+
+    _begin_immediate(conn, cur)
+    try:
+        cur.executemany("INSERT OR IGNORE INTO schedule_templates(barber_id,barbershop_id,weekday,time) VALUES(?,?,?,?)", template_rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return len(missing)
 
 def reset_availability():
+    # Apaga todas as exceções: a agenda volta a seguir apenas os modelos semanais
     conn = get_conn()
     cur = conn.cursor()
     cur.execute("DELETE FROM availability")
     conn.commit()
-    seed_default_availability(conn)
     conn.close()
 
 def get_barbershops():
@@ -263,6 +865,9 @@ def get_barbershops():
     return rows
 
 def get_barbershop(shop_id):
+    return _cached("barbershops", ("get_barbershop", shop_id), lambda: _get_barbershop(shop_id))
+
+def _get_barbershop(shop_id):
     conn = get_conn()
     cur = conn.cursor()
     cur.execute("SELECT * FROM barbershops WHERE id=?", (shop_id,))
@@ -271,6 +876,9 @@ def get_barbershop(shop_id):
     return row
 
 def get_barbershop_by_slug(slug):
+    return _cached("barbershops", ("get_barbershop_by_slug", slug), lambda: _get_barbershop_by_slug(slug))
+
+def _get_barbershop_by_slug(slug):
     conn = get_conn()
     cur = conn.cursor()
     cur.execute("SELECT * FROM barbershops WHERE slug=?", (slug,))
@@ -285,6 +893,7 @@ def update_barbershop(shop_id, name, slug, phone, address):
                 (name, slug, phone, address, shop_id))
     conn.commit()
     conn.close()
+    _invalidate_cache("barbershops")
 
 def toggle_barbershop_status(shop_id):
     conn = get_conn()
@@ -296,8 +905,12 @@ def toggle_barbershop_status(shop_id):
         cur.execute("UPDATE barbershops SET active=? WHERE id=?", (new_status, shop_id))
         conn.commit()
     conn.close()
+    _invalidate_cache("barbershops")
 
 def get_users_by_barbershop(shop_id):
+    return list(_cached("users", ("get_users_by_barbershop", shop_id), lambda: _get_users_by_barbershop(shop_id)))
+
+def _get_users_by_barbershop(shop_id):
     conn = get_conn()
     cur = conn.cursor()
     cur.execute("SELECT * FROM users WHERE barbershop_id=?", (shop_id,))
@@ -309,17 +922,20 @@ def delete_barbershop(shop_id):
     conn = get_conn()
     cur = conn.cursor()
     # Delete related data
+    cur.execute("DELETE FROM booking_services WHERE booking_id IN (SELECT id FROM bookings WHERE barbershop_id=?)", (shop_id,))
     cur.execute("DELETE FROM bookings WHERE barbershop_id=?", (shop_id,))
     cur.execute("DELETE FROM availability WHERE barbershop_id=?", (shop_id,))
+    cur.execute("DELETE FROM schedule_templates WHERE barber_id IN (SELECT id FROM users WHERE barbershop_id=?)", (shop_id,))
     cur.execute("DELETE FROM users WHERE barbershop_id=?", (shop_id,))
     cur.execute("DELETE FROM barbershops WHERE id=?", (shop_id,))
     conn.commit()
     conn.close()
+    _invalidate_cache("barbershops", "users")
 
 def create_user(username, password, role="cliente", barbearia_nome=None, phone=None, barbershop_id=None, email=None):
     conn = get_conn()
     cur = conn.cursor()
-    ph = generate_password_hash(password)
+    ph = hash_password(password)
     
     # Se não foi passado barbershop_id, tenta pegar o primeiro (default)
     if barbershop_id is None:
@@ -333,12 +949,15 @@ def create_user(username, password, role="cliente", barbearia_nome=None, phone=N
     user_id = cur.lastrowid
     conn.commit()
     conn.close()
+    _invalidate_cache("users")
     
     if role == "barbeiro":
-        seed_availability_for_barber(user_id)
+        seed_availability_for_barber(user_id, barbershop_id)
     return user_id
 
 def update_user_profile(user_id, username=None, password=None, barbearia_nome=None, phone=None, address=None):
+    # Hash calculado antes de abrir a transação
+    password_hash = hash_password(password) if password else None
     conn = get_conn()
     cur = conn.cursor()
     
@@ -373,7 +992,7 @@ def update_user_profile(user_id, username=None, password=None, barbearia_nome=No
         params.append(username)
     if password:
         fields.append("password_hash=?")
-        params.append(generate_password_hash(password))
+        params.append(password_hash)
     if barbearia_nome:
         fields.append("barbearia_nome=?")
         params.append(barbearia_nome)
@@ -384,14 +1003,16 @@ def update_user_profile(user_id, username=None, password=None, barbearia_nome=No
         
     conn.commit()
     conn.close()
+    _invalidate_cache("users", "barbershops")
 
-def seed_availability_for_barber(barber_id):
+def seed_availability_for_barber(barber_id, barbershop_id=None):
+    # Grava o modelo semanal padrão do barbeiro. Os horários de cada dia são
+    # calculados a partir dele; availability guarda apenas as exceções.
     conn = get_conn()
     cur = conn.cursor()
-    times = generate_default_times()
-    for day in range(1,32):
-        for t in times:
-            cur.execute("INSERT INTO availability(day,time,active,barber_id) VALUES(?,?,1,?)", (day,t,barber_id))
+    rows = _template_rows(barber_id, barbershop_id, generate_default_times())
+    _begin_immediate(conn, cur)
+    cur.executemany("INSERT OR IGNORE INTO schedule_templates(barber_id,barbershop_id,weekday,time) VALUES(?,?,?,?)", rows)
     conn.commit()
     conn.close()
 
@@ -404,6 +1025,9 @@ def get_user_by_username(username):
     return row
 
 def get_user_by_id(user_id):
+    return _cached("users", ("get_user_by_id", user_id), lambda: _get_user_by_id(user_id))
+
+def _get_user_by_id(user_id):
     conn = get_conn()
     cur = conn.cursor()
     cur.execute("SELECT * FROM users WHERE id=?", (user_id,))
@@ -411,42 +1035,151 @@ def get_user_by_id(user_id):
     conn.close()
     return row
 
+# === Senhas ===
+# Política de hash (formato do werkzeug, ex.: "scrypt:32768:8:1" ou
+# "pbkdf2:sha256:600000"). Hashes gravados com outros parâmetros são refeitos
+# no próximo login bem-sucedido.
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+
+# Quantos hashes cada processo calcula ao mesmo tempo. Cada scrypt usa
+# 128 * n * r bytes (32 MiB com a política padrão) e um núcleo inteiro; sem
+# limite, um pico de logins ocuparia todas as threads do gunicorn (3 x 8 por
+# padrão, até 768 MiB) e deixaria as outras rotas sem CPU.
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", "2"))
+
+_hash_slots = None
+_hash_slots_pid = None
+_hash_slots_lock = threading.Lock()
+
+def _hash_semaphore():
+    global _hash_slots, _hash_slots_pid
+    # Um semáforo por processo: o herdado no fork pode ter vagas presas por
+    # threads que não existem no filho
+    if _hash_slots_pid != os.getpid():
+        with _hash_slots_lock:
+            if _hash_slots_pid != os.getpid():
+                _hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_CONCURRENCY)
+                _hash_slots_pid = os.getpid()
+    return _hash_slots
+
+# O hash roda na própria thread da requisição (o scrypt do hashlib libera o
+# GIL); as demais esperam a vez no semáforo.
+def hash_password(password):
+    with _hash_semaphore():
+        return generate_password_hash(password, PASSWORD_HASH_METHOD)
+
+def check_password(pwhash, password):
+    with _hash_semaphore():
+        return check_password_hash(pwhash, password)
+
+_hash_prefix = None
+
+def password_needs_rehash(pwhash):
+    global _hash_prefix
+    # O prefixo do hash ("método:parâmetros$salt$hash") diz com que política foi
+    # gerado. O prefixo da política atual vem de um hash real, para que formas
+    # abreviadas (ex.: "pbkdf2") sejam comparadas já com os valores padrão.
+    if _hash_prefix is None:
+        _hash_prefix = hash_password("").split("$", 1)[0]
+    return pwhash.split("$", 1)[0] != _hash_prefix
+
+def get_principal_by_username(username):
+    # Usuário e sua barbearia em uma única consulta (login)
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT u.id, u.username, u.password_hash, u.role, u.barbershop_id,
+               b.name AS barbershop_name, b.slug AS barbershop_slug
+        FROM users u
+        LEFT JOIN barbershops b ON b.id = u.barbershop_id
+        WHERE u.username=?
+    """, (username,))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
 def verify_user(username, password):
-    u = get_user_by_username(username)
+    u = get_principal_by_username(username)
     if not u:
         return None
-    if check_password_hash(u["password_hash"], password):
-        return {"id": u["id"], "username": u["username"], "role": u["role"]}
-    return None
+    if not check_password(u["password_hash"], password):
+        return None
+    if password_needs_rehash(u["password_hash"]):
+        new_hash = hash_password(password)
+        conn = get_conn()
+        cur = conn.cursor()
+        # Só troca se o hash não mudou desde a leitura (ex.: troca de senha em paralelo)
+        cur.execute("UPDATE users SET password_hash=? WHERE id=? AND password_hash=?", (new_hash, u["id"], u["password_hash"]))
+        conn.commit()
+        conn.close()
+        _invalidate_cache("users")
+    return {
+        "id": u["id"],
+        "username": u["username"],
+        "role": u["role"],
+        "barbershop_id": u["barbershop_id"],
+        "barbershop_name": u["barbershop_name"],
+        "barbershop_slug": u["barbershop_slug"],
+    }
 
-def ensure_daily_slots(conn, day, month, year, barber_id, barbershop_id=None):
-    cur = conn.cursor()
-    # Verifica se já existem slots para este dia/mês/ano/barbeiro/barbearia
-    query = "SELECT COUNT(*) c FROM availability WHERE day=? AND month=? AND year=?"
-    params = [day, month, year]
-    
-    if barber_id is None:
-        query += " AND barber_id IS NULL"
-    else:
-        query += " AND barber_id=?"
-        params.append(barber_id)
-    
-    if barbershop_id is None:
-        query += " AND barbershop_id IS NULL"
-    else:
-        query += " AND barbershop_id=?"
-        params.append(barbershop_id)
-        
-    cur.execute(query, tuple(params))
-    count = cur.fetchone()["c"]
-    
-    if count == 0:
-        # Se não existe, cria os slots padrão
+def get_week_template(barber_id):
+    # Modelo semanal do barbeiro: {dia_da_semana: [horários]} (0=Segunda ... 6=Domingo).
+    # Barbeiros sem modelo gravado usam os horários padrão em todos os dias.
+    conn = get_conn()
+    template = _read_week_template(conn.cursor(), barber_id)
+    conn.close()
+    return template
+
+def _read_week_template(cur, barber_id):
+    rows = []
+    if barber_id is not None:
+        cur.execute("SELECT weekday, time FROM schedule_templates WHERE barber_id=? ORDER BY weekday, time", (barber_id,))
+        rows = cur.fetchall()
+    if not rows:
         times = generate_default_times()
-        for t in times:
-            insert_sql = "INSERT OR IGNORE INTO availability(day, month, year, time, active, barber_id, barbershop_id) VALUES(?, ?, ?, ?, 1, ?, ?)"
-            cur.execute(insert_sql, (day, month, year, t, barber_id, barbershop_id))
-        conn.commit()
+        return {wd: list(times) for wd in range(7)}
+    template = {wd: [] for wd in range(7)}
+    for r in rows:
+        template[r["weekday"]].append(r["time"])
+    return template
+
+def _build_slots(template_times, override_rows, taken_times):
+    # Slots do dia = horários do modelo semanal + exceções gravadas em availability.
+    # Uma exceção com active=0 desativa o horário; com active=1 adiciona/reativa.
+    merged = {t: {"id": None, "active": True} for t in template_times}
+    for r in override_rows:
+        merged[r["time"]] = {"id": r["id"], "active": r["active"] == 1}
+
+    slots = []
+    for t in sorted(merged, key=time_to_minutes):
+        is_taken = t in taken_times
+        slots.append({
+            "id": merged[t]["id"], 
+            "time": t, 
+            "minute": time_to_minutes(t),
+            "available": (merged[t]["active"] and not is_taken),
+            "active": merged[t]["active"],
+            "is_taken": is_taken
+        })
+    return slots
+
+def get_calendar_version(year, month, barber_id=None, barbershop_id=None):
+    # (versão do mês, versão do modelo semanal) do barbeiro; muda a cada escrita
+    # em bookings/availability do mês ou no modelo semanal. 0 = nunca alterado.
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT year, version FROM calendar_versions
+        WHERE barber_id=? AND ((barbershop_id=? AND year=? AND month=?) OR (barbershop_id=0 AND year=0 AND month=0))
+    """, (barber_id or 0, barbershop_id or 0, year, month))
+    month_version = template_version = 0
+    for r in cur.fetchall():
+        if r["year"] == 0:
+            template_version = r["version"]
+        else:
+            month_version = r["version"]
+    conn.close()
+    return month_version, template_version
 
 def get_availability(day, year=None, month=None, barber_id=None, barbershop_id=None):
     if year is None or month is None:
@@ -454,14 +1187,13 @@ def get_availability(day, year=None, month=None, barber_id=None, barbershop_id=N
         if year is None: year = now.year
         if month is None: month = now.month
 
+    try:
+        weekday = date(year, month, day).weekday()
+    except ValueError:
+        return []
+    template = get_week_template(barber_id)
+
     conn = get_conn()
-    
-    # Se barbershop_id não for passado, tenta inferir do barber_id ou pegar default?
-    # Melhor deixar explícito. Se None, pode misturar dados.
-    
-    # Garante que existem slots para este dia específico
-    ensure_daily_slots(conn, day, month, year, barber_id, barbershop_id)
-    
     cur = conn.cursor()
     
     query_avail = "SELECT id, time, active FROM availability WHERE day=? AND month=? AND year=?"
@@ -478,11 +1210,9 @@ def get_availability(day, year=None, month=None, barber_id=None, barbershop_id=N
     else:
         query_avail += " AND barbershop_id=?"
         params_avail.append(barbershop_id)
-        
-    query_avail += " ORDER BY time"
     
     cur.execute(query_avail, tuple(params_avail))
-    avail_rows = cur.fetchall()
+    override_rows = cur.fetchall()
 
     # Busca agendamentos confirmados para marcar como ocupado
     query_book = "SELECT time FROM bookings WHERE day=? AND status='confirmado' AND year=? AND month=?"
@@ -504,20 +1234,58 @@ def get_availability(day, year=None, month=None, barber_id=None, barbershop_id=N
     taken_rows = cur.fetchall()
     taken_times = {row["time"] for row in taken_rows}
     
-    slots = []
-    for r in avail_rows:
-        is_taken = r["time"] in taken_times
-        slots.append({
-            "id": r["id"], 
-            "time": r["time"], 
-            "available": (r["active"] == 1 and not is_taken),
-            "active": (r["active"] == 1),
-            "is_taken": is_taken
-        })
-    
+    slots = _build_slots(template[weekday], override_rows, taken_times)
     conn.close()
     return slots
 
+def get_month_availability(year, month, barber_id=None, barbershop_id=None):
+    # Versão mensal de get_availability: retorna {dia: slots} para o mês inteiro
+    # com um número fixo de consultas (em vez de 3 consultas por dia).
+    num_days = calendar.monthrange(year, month)[1]
+    template = get_week_template(barber_id)
+
+    owner_sql = ""
+    owner_params = []
+    if barber_id is None:
+        owner_sql += " AND barber_id IS NULL"
+    else:
+        owner_sql += " AND barber_id=?"
+        owner_params.append(barber_id)
+    if barbershop_id is None:
+        owner_sql += " AND barbershop_id IS NULL"
+    else:
+        owner_sql += " AND barbershop_id=?"
+        owner_params.append(barbershop_id)
+
+    conn = get_conn()
+    cur = conn.cursor()
+
+    cur.execute(
+        "SELECT id, day, time, active FROM availability WHERE month=? AND year=?" + owner_sql,
+        tuple([month, year] + owner_params),
+    )
+    overrides_by_day = {}
+    for r in cur.fetchall():
+        overrides_by_day.setdefault(r["day"], []).append(r)
+
+    cur.execute(
+        "SELECT day, time FROM bookings WHERE status='confirmado' AND year=? AND month=?" + owner_sql,
+        tuple([year, month] + owner_params),
+    )
+    taken_by_day = {}
+    for r in cur.fetchall():
+        taken_by_day.setdefault(r["day"], set()).add(r["time"])
+
+    conn.close()
+    return {
+        d: _build_slots(
+            template[date(year, month, d).weekday()],
+            overrides_by_day.get(d, []),
+            taken_by_day.get(d, set()),
+        )
+        for d in range(1, num_days + 1)
+    }
+
 def is_slot_taken(day, time, year=None, month=None, barber_id=None, barbershop_id=None):
     conn = get_conn()
     cur = conn.cursor()
@@ -545,30 +1313,47 @@ def is_slot_taken(day, time, year=None, month=None, barber_id=None, barbershop_i
     conn.close()
     return c > 0
 
-def create_booking(user_id, day, time, service="corte de cabelo", year=None, month=None, customer_phone=None, barber_id=None, customer_name=None, barbershop_id=None, price_cents=None, service_id=None):
+def create_booking(user_id, day, time, service="corte de cabelo", year=None, month=None, customer_phone=None, barber_id=None, customer_name=None, barbershop_id=None, price_cents=None, service_id=None, services=None):
+    # services: linhas de get_services_by_ids, gravadas em booking_services
+    # na mesma transação do agendamento
     if year is None or month is None:
         now = datetime.now()
         if year is None:
             year = now.year
         if month is None:
             month = now.month
-    if is_slot_taken(day, time, year, month, barber_id, barbershop_id):
-        return False
     
     if price_cents is None:
         price_cents = 0
     if service_id is None:
         service_id = None
     
+    # Verificação e inserção em um único comando, dentro de uma transação de escrita
+    # (BEGIN IMMEDIATE): dois workers não conseguem reservar o mesmo horário.
+    # O índice único parcial idx_bookings_slot_unique garante o mesmo no banco.
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO bookings(user_id,day,month,year,time,status,created_at,service,customer_phone,customer_name,barber_id,barbershop_id,price_cents,service_id) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
-        (user_id, day, month, year, time, "confirmado", datetime.now(), service, customer_phone, customer_name, barber_id, barbershop_id, price_cents, service_id)
-    )
-    conn.commit()
+    try:
+        _begin_immediate(conn, cur)
+        cur.execute(
+            "INSERT INTO bookings(user_id,day,month,year,time,status,created_at,service,customer_phone,customer_name,barber_id,barbershop_id,price_cents,service_id) "
+            "SELECT ?,?,?,?,?,?,?,?,?,?,?,?,?,? "
+            "WHERE NOT EXISTS (SELECT 1 FROM bookings WHERE barber_id IS ? AND barbershop_id IS ? AND year=? AND month=? AND day=? AND time=? AND status='confirmado')",
+            (user_id, day, month, year, time, "confirmado", datetime.now(), service, customer_phone, customer_name, barber_id, barbershop_id, price_cents, service_id,
+             barber_id, barbershop_id, year, month, day, time)
+        )
+        created = cur.rowcount == 1
+        if created and services:
+            booking_id = cur.lastrowid
+            cur.executemany(
+                "INSERT INTO booking_services(booking_id, service_id, name, price_cents) VALUES(?,?,?,?)",
+                [(booking_id, sv["id"], sv["name"], sv["price_cents"] or 0) for sv in services]
+            )
+        conn.commit()
+    except backends.INTEGRITY_ERRORS:
+        created = False
     conn.close()
-    return True
+    return created
 
 def get_bookings_by_user(user_id):
     conn = get_conn()
@@ -582,6 +1367,88 @@ def get_bookings_by_user(user_id):
     conn.close()
     return rows
 
+def _date_key(d, end=False):
+    # (date_iso, minute_of_day) de um limite: datetime vale até o minuto; date
+    # ou "YYYY-MM-DD" vale pelo dia inteiro (00:00 no início, 23:59 no fim).
+    if isinstance(d, datetime):
+        return d.strftime("%Y-%m-%d"), d.hour * 60 + d.minute
+    iso = d if isinstance(d, str) else d.strftime("%Y-%m-%d")
+    return iso, (1439 if end else 0)
+
+def get_bookings_between(start, end, barber_id=None, barbershop_id=None):
+    # Agendamentos confirmados de start a end (inclusive), mesmo atravessando
+    # meses/anos: um único range scan em idx_bookings_barber_date.
+    conn = get_conn()
+    cur = conn.cursor()
+    sql = """
+        SELECT b.id, b.user_id, b.day, b.month, b.year, b.time, b.date_iso, b.minute_of_day, b.status, b.created_at, b.service, b.customer_phone, b.customer_name, b.price_cents, u.username
+        FROM bookings b
+        JOIN users u ON b.user_id = u.id
+        WHERE b.status='confirmado'
+    """
+    params = []
+    if barber_id is None:
+        sql += " AND b.barber_id IS NULL"
+    else:
+        sql += " AND b.barber_id=?"
+        params.append(barber_id)
+
+    if barbershop_id is None:
+        sql += " AND b.barbershop_id IS NULL"
+    else:
+        sql += " AND b.barbershop_id=?"
+        params.append(barbershop_id)
+
+    sql += " AND (b.date_iso, b.minute_of_day) >= (?, ?) AND (b.date_iso, b.minute_of_day) <= (?, ?)"
+    sql += " ORDER BY b.date_iso, b.minute_of_day, b.id"
+    params.extend(_date_key(start))
+    params.extend(_date_key(end, end=True))
+    cur.execute(sql, tuple(params))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def get_bookings_page(barber_id=None, barbershop_id=None, after=None, before=None, limit=50):
+    # Janela de agendamentos confirmados por keyset (date_iso, minute_of_day, id),
+    # equivalente a (year, month, day, time, id). after=(data, minuto, id) lista
+    # os próximos em ordem crescente; before=(...) lista os anteriores em ordem
+    # decrescente. Lê só a janela pedida em idx_bookings_barber_date.
+    conn = get_conn()
+    cur = conn.cursor()
+    sql = """
+        SELECT b.id, b.user_id, b.day, b.month, b.year, b.time, b.date_iso, b.minute_of_day, b.status, b.created_at, b.service, b.customer_phone, b.customer_name, b.price_cents, u.username
+        FROM bookings b
+        JOIN users u ON b.user_id = u.id
+        WHERE b.status='confirmado'
+    """
+    params = []
+    if barber_id is None:
+        sql += " AND b.barber_id IS NULL"
+    else:
+        sql += " AND b.barber_id=?"
+        params.append(barber_id)
+
+    if barbershop_id is None:
+        sql += " AND b.barbershop_id IS NULL"
+    else:
+        sql += " AND b.barbershop_id=?"
+        params.append(barbershop_id)
+
+    if before is not None:
+        sql += " AND (b.date_iso, b.minute_of_day, b.id) < (?, ?, ?) ORDER BY b.date_iso DESC, b.minute_of_day DESC, b.id DESC"
+        params.extend(before)
+    else:
+        if after is not None:
+            sql += " AND (b.date_iso, b.minute_of_day, b.id) > (?, ?, ?)"
+            params.extend(after)
+        sql += " ORDER BY b.date_iso, b.minute_of_day, b.id"
+    sql += " LIMIT ?"
+    params.append(limit)
+    cur.execute(sql, tuple(params))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
 def get_bookings_by_day_with_usernames(day, year=None, month=None, barber_id=None, barbershop_id=None):
     conn = get_conn()
     cur = conn.cursor()
@@ -614,12 +1481,31 @@ def get_bookings_by_day_with_usernames(day, year=None, month=None, barber_id=Non
     conn.close()
     return rows
 
-def cancel_booking(booking_id):
+def _booking_owner_filter(user_id, barber_id):
+    sql = ""
+    params = []
+    if user_id is not None:
+        sql += " AND user_id=?"
+        params.append(user_id)
+    if barber_id is not None:
+        sql += " AND barber_id=?"
+        params.append(barber_id)
+    return sql, params
+
+def cancel_booking(booking_id, user_id=None, barber_id=None):
+    # Verificação de dono e cancelamento no mesmo UPDATE; False se o agendamento
+    # não existe, já foi cancelado ou não pertence a user_id/barber_id
+    owner_sql, owner_params = _booking_owner_filter(user_id, barber_id)
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("UPDATE bookings SET status='cancelado' WHERE id=?", (booking_id,))
+    cur.execute(
+        "UPDATE bookings SET status='cancelado' WHERE id=? AND status='confirmado'" + owner_sql,
+        tuple([booking_id] + owner_params)
+    )
+    cancelled = cur.rowcount == 1
     conn.commit()
     conn.close()
+    return cancelled
 
 def get_all_bookings_with_usernames(barber_id=None, barbershop_id=None):
     conn = get_conn()
@@ -651,6 +1537,9 @@ def get_all_bookings_with_usernames(barber_id=None, barbershop_id=None):
     return rows
 
 def get_services_for_barber(barber_id, barbershop_id=None):
+    return list(_cached("services", ("get_services_for_barber", barber_id, barbershop_id), lambda: _get_services_for_barber(barber_id, barbershop_id)))
+
+def _get_services_for_barber(barber_id, barbershop_id=None):
     conn = get_conn()
     cur = conn.cursor()
     sql = "SELECT id, name, price_cents, active FROM services WHERE barber_id=?"
@@ -682,6 +1571,36 @@ def get_service_by_id(service_id, barber_id=None, barbershop_id=None):
     conn.close()
     return row
 
+def get_services_by_ids(ids, barber_id=None, barbershop_id=None):
+    # Serviços ativos da seleção, em uma única consulta e na ordem de ids.
+    # Ids repetidos contam uma vez; ids de outro barbeiro/barbearia ou
+    # desativados ficam de fora (quem chama compara o tamanho para validar).
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return []
+    conn = get_conn()
+    cur = conn.cursor()
+    sql = f"SELECT id, barber_id, barbershop_id, name, price_cents, active FROM services WHERE id IN ({','.join('?' * len(ids))}) AND active=1"
+    params = list(ids)
+    if barber_id is not None:
+        sql += " AND barber_id=?"
+        params.append(barber_id)
+    if barbershop_id is not None:
+        sql += " AND (barbershop_id=? OR barbershop_id IS NULL OR barbershop_id=0)"
+        params.append(barbershop_id)
+    cur.execute(sql, tuple(params))
+    rows = {r["id"]: r for r in cur.fetchall()}
+    conn.close()
+    return [rows[i] for i in ids if i in rows]
+
+def get_booking_services(booking_id):
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT service_id, name, price_cents FROM booking_services WHERE booking_id=?", (booking_id,))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
 def create_service(barber_id, barbershop_id, name, price_cents):
     conn = get_conn()
     cur = conn.cursor()
@@ -691,6 +1610,7 @@ def create_service(barber_id, barbershop_id, name, price_cents):
     )
     conn.commit()
     conn.close()
+    _invalidate_cache("services")
 
 def update_service(service_id, barber_id, barbershop_id, name, price_cents):
     conn = get_conn()
@@ -703,6 +1623,7 @@ def update_service(service_id, barber_id, barbershop_id, name, price_cents):
     cur.execute(sql, tuple(params))
     conn.commit()
     conn.close()
+    _invalidate_cache("services")
 
 def delete_service(service_id, barber_id, barbershop_id):
     conn = get_conn()
@@ -715,22 +1636,25 @@ def delete_service(service_id, barber_id, barbershop_id):
     cur.execute(sql, tuple(params))
     conn.commit()
     conn.close()
+    _invalidate_cache("services")
 
 def get_monthly_stats_for_barber(barber_id, barbershop_id=None):
+    # Lê os totais já agregados (booking_monthly_stats): o custo não depende do histórico.
+    # barbershop_id 0 também representa agendamentos sem barbearia (NULL).
     conn = get_conn()
     cur = conn.cursor()
     sql = """
-        SELECT year, month, COUNT(*) AS total_cortes, COALESCE(SUM(price_cents), 0) AS total_revenue
-        FROM bookings
-        WHERE status='confirmado' AND barber_id=?
+        SELECT year, month, SUM(total_cortes) AS total_cortes, SUM(total_revenue) AS total_revenue
+        FROM booking_monthly_stats
+        WHERE barber_id=?
     """
     params = [barber_id]
     if barbershop_id is None:
-        sql += " AND (barbershop_id IS NULL OR barbershop_id=0)"
+        sql += " AND barbershop_id=0"
     else:
-        sql += " AND (barbershop_id=? OR barbershop_id IS NULL OR barbershop_id=0)"
+        sql += " AND barbershop_id IN (?, 0)"
         params.append(barbershop_id)
-    sql += " GROUP BY year, month ORDER BY year DESC, month DESC"
+    sql += " GROUP BY year, month HAVING SUM(total_cortes) > 0 ORDER BY year DESC, month DESC"
     cur.execute(sql, tuple(params))
     rows = cur.fetchall()
     conn.close()
@@ -771,14 +1695,26 @@ def update_dia(dia_id, novo_dia):
 def get_db_connection():
     return get_conn()
 
-def cancel_booking_by_details(day, time, year, month):
+def cancel_booking_by_details(day, time, year, month, barber_id=None, barbershop_id=None):
     conn = get_conn()
     cur = conn.cursor()
     # Find booking id
-    cur.execute(
-        "SELECT id FROM bookings WHERE day=? AND time=? AND year=? AND month=? AND status='confirmado'",
-        (day, time, year, month)
-    )
+    query = "SELECT id FROM bookings WHERE day=? AND time=? AND year=? AND month=? AND status='confirmado'"
+    params = [day, time, year, month]
+
+    if barber_id is None:
+        query += " AND barber_id IS NULL"
+    else:
+        query += " AND barber_id=?"
+        params.append(barber_id)
+
+    if barbershop_id is None:
+        query += " AND barbershop_id IS NULL"
+    else:
+        query += " AND barbershop_id=?"
+        params.append(barbershop_id)
+
+    cur.execute(query, tuple(params))
     row = cur.fetchone()
     if row:
         booking_id = row["id"]
@@ -809,13 +1745,55 @@ def set_day_active(day, active, year=None, month=None, barber_id=None, barbersho
         now = datetime.now()
         if year is None: year = now.year
         if month is None: month = now.month
-        
+
+    try:
+        weekday = date(year, month, day).weekday()
+    except ValueError:
+        return
+    template_times = get_week_template(barber_id)[weekday]
+
     conn = get_conn()
-    ensure_daily_slots(conn, day, month, year, barber_id, barbershop_id)
     cur = conn.cursor()
     
-    query = "UPDATE availability SET active=? WHERE day=? AND month=? AND year=?"
-    params = [active, day, month, year]
+    owner_sql = ""
+    owner_params = []
+    if barber_id is None:
+        owner_sql += " AND barber_id IS NULL"
+    else:
+        owner_sql += " AND barber_id=?"
+        owner_params.append(barber_id)
+        
+    if barbershop_id is None:
+        owner_sql += " AND barbershop_id IS NULL"
+    else:
+        owner_sql += " AND barbershop_id=?"
+        owner_params.append(barbershop_id)
+        
+    cur.execute(
+        "UPDATE availability SET active=? WHERE day=? AND month=? AND year=?" + owner_sql,
+        tuple([active, day, month, year] + owner_params),
+    )
+
+    if not active:
+        # Horários do modelo semanal sem exceção recebem uma exceção desativada
+        cur.execute(
+            "SELECT time FROM availability WHERE day=? AND month=? AND year=?" + owner_sql,
+            tuple([day, month, year] + owner_params),
+        )
+        existing = {r["time"] for r in cur.fetchall()}
+        cur.executemany(
+            "INSERT INTO availability(day, month, year, time, active, barber_id, barbershop_id) VALUES(?, ?, ?, ?, 0, ?, ?)",
+            [(day, month, year, t, barber_id, barbershop_id) for t in template_times if t not in existing],
+        )
+    conn.commit()
+    conn.close()
+
+def set_slot_active_at(day, time, active, year, month, barber_id=None, barbershop_id=None):
+    # Ativa/desativa um horário identificado pela data (slots do modelo semanal não têm id)
+    conn = get_conn()
+    cur = conn.cursor()
+    query = "UPDATE availability SET active=? WHERE day=? AND month=? AND year=? AND time=?"
+    params = [active, day, month, year, time]
     
     if barber_id is None:
         query += " AND barber_id IS NULL"
@@ -828,22 +1806,27 @@ def set_day_active(day, active, year=None, month=None, barber_id=None, barbersho
     else:
         query += " AND barbershop_id=?"
         params.append(barbershop_id)
-        
+
     cur.execute(query, tuple(params))
+    if cur.rowcount == 0:
+        cur.execute(
+            "INSERT INTO availability(day, month, year, time, active, barber_id, barbershop_id) VALUES(?, ?, ?, ?, ?, ?, ?)",
+            (day, month, year, time, active, barber_id, barbershop_id),
+        )
     conn.commit()
     conn.close()
 
 def restore_day_availability(day, year=None, month=None, barber_id=None, barbershop_id=None):
+    # Remove as exceções do dia: os horários voltam a seguir o modelo semanal
     if year is None or month is None:
         now = datetime.now()
         if year is None: year = now.year
         if month is None: month = now.month
 
     conn = get_conn()
-    ensure_daily_slots(conn, day, month, year, barber_id, barbershop_id)
     cur = conn.cursor()
     
-    query = "UPDATE availability SET active=1 WHERE day=? AND month=? AND year=?"
+    query = "DELETE FROM availability WHERE day=? AND month=? AND year=?"
     params = [day, month, year]
     
     if barber_id is None:
@@ -0,0 +1,80 @@
+import os
+import sys
+import uuid
+from urllib.parse import urlsplit, urlunsplit
+
+import pytest
+
+# Os módulos do app ficam na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Hash barato: os testes criam vários usuários
+os.environ.setdefault("PASSWORD_HASH_METHOD", "pbkdf2:sha256:1000")
+
+import backends
+import storage
+
+# Os testes que usam `db` rodam no SQLite e, com TEST_POSTGRES_URL definido
+# (ex.: postgresql://postgres@localhost/postgres), também no PostgreSQL. O
+# usuário precisa poder criar bancos: cada teste usa um banco descartável.
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def database_url(request, tmp_path):
+    if request.param == "sqlite":
+        yield "sqlite:///" + str(tmp_path / "test.db")
+        return
+    if not TEST_POSTGRES_URL:
+        pytest.skip("defina TEST_POSTGRES_URL para rodar também no PostgreSQL")
+    psycopg2 = pytest.importorskip("psycopg2")
+    name = "agenda_test_" + uuid.uuid4().hex[:12]
+    admin = psycopg2.connect(TEST_POSTGRES_URL)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE DATABASE {name}")
+    url = urlunsplit(urlsplit(TEST_POSTGRES_URL)._replace(path="/" + name))
+    try:
+        yield url
+    finally:
+        # Fecha o pool do banco descartável antes de apagá-lo
+        backend = backends._backends.pop(url, None)
+        if backend is not None and backend._pool is not None:
+            backend._pool.closeall()
+        admin.cursor().execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+        admin.close()
+
+
+@pytest.fixture
+def db(database_url, monkeypatch):
+    # Banco novo e migrado para cada teste; storage lê DATABASE_URL a cada conexão
+    monkeypatch.setenv("DATABASE_URL", database_url)
+    storage.close_conn()
+    storage.clear_cache()
+    storage.init_db()
+    yield storage
+    storage.close_conn()
+    storage.clear_cache()
+
+
+@pytest.fixture
+def shop(db):
+    # Barbearia com um barbeiro (modelo semanal padrão) e um cliente
+    conn = db.get_conn()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO barbershops(name, slug, phone) VALUES('Loja Um', 'loja-um', '1190000')")
+    shop_id = cur.lastrowid
+    conn.commit()
+    barber_id = db.create_user("barbeiro1", "x", role="barbeiro", barbershop_id=shop_id)
+    client_id = db.create_user("cliente1", "x", role="cliente", barbershop_id=shop_id)
+    return {"shop_id": shop_id, "barber_id": barber_id, "client_id": client_id}
+
+
+@pytest.fixture
+def app_module(db, shop):
+    # app.py roda init_db e lê a configuração ao ser importado: só depois do banco
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,105 @@
+import re
+from datetime import timedelta
+
+import pytest
+
+
+@pytest.fixture
+def public(client, shop):
+    # Visitante que escolheu a barbearia pelo link público
+    client.get("/b/loja-um")
+    return client
+
+
+def _future_day(app_module, days=40):
+    day = app_module.get_local_now().date() + timedelta(days=days)
+    if day.weekday() == 6:
+        day += timedelta(days=1)
+    return day
+
+
+def test_horarios_revalidates_with_etag(public, shop, app_module):
+    day = _future_day(app_module)
+    url = f"/horarios/{day.day}?ano={day.year}&mes={day.month}&barber_id={shop['barber_id']}"
+    first = public.get(url)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+
+    cached = public.get(url, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.data == b""
+
+    booked = public.post("/reservar", json={
+        "dia": day.day, "horario": "08:00", "ano": day.year, "mes": day.month,
+        "barber_id": shop["barber_id"], "customer_name": "Ana", "service": "Corte",
+    })
+    assert booked.get_json()["success"]
+    changed = public.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert "08:00" not in changed.get_json()["horarios"]
+    assert changed.headers["ETag"] != etag
+
+
+def test_template_change_invalidates_etag(public, shop, db, app_module):
+    day = _future_day(app_module)
+    url = f"/horarios/{day.day}?ano={day.year}&mes={day.month}&barber_id={shop['barber_id']}"
+    etag = public.get(url).headers["ETag"]
+    conn = db.get_conn()
+    conn.execute("DELETE FROM schedule_templates WHERE barber_id=? AND time='10:00'", (shop["barber_id"],))
+    conn.commit()
+    assert public.get(url, headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_agenda_revalidates_with_etag(public):
+    first = public.get("/agenda")
+    assert first.status_code == 200
+    assert public.get("/agenda", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+
+def test_agenda_etag_depends_on_session(public, app_module):
+    etag = public.get("/agenda").headers["ETag"]
+    barber = app_module.app.test_client()
+    barber.post("/login", data={"usuario": "barbeiro1", "senha": "x"})
+    assert barber.get("/agenda", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_bookings_api_pages_with_cursor(client, shop, db):
+    for day in range(1, 8):
+        for t in ("08:00", "09:00", "13:00"):
+            db.create_booking(shop["client_id"], day, t, year=2030, month=1, barber_id=shop["barber_id"], barbershop_id=shop["shop_id"])
+    client.post("/login", data={"usuario": "barbeiro1", "senha": "x"})
+
+    seen = []
+    cursor = "2029-12-31|0|0"
+    while cursor:
+        page = client.get("/api/agendamentos", query_string={"after": cursor, "limit": 5}).get_json()
+        assert page["success"]
+        assert len(page["agendamentos"]) <= 5
+        seen.extend((b["day"], b["time"]) for b in page["agendamentos"])
+        cursor = page["next_cursor"]
+    assert seen == [(d, t) for d in range(1, 8) for t in ("08:00", "09:00", "13:00")]
+
+    assert client.get("/api/agendamentos", query_string={"after": "lixo"}).status_code == 400
+
+
+def test_server_timing_on_every_response(public, db):
+    # A conexão aberta antes de importar o app não é medida no SQLite
+    db.close_conn()
+    timing = public.get("/agenda").headers["Server-Timing"]
+    parts = dict(re.findall(r'(\w+);dur=([\d.]+)', timing))
+    assert set(parts) == {"db", "tpl", "app", "total"}
+    assert float(parts["db"]) > 0 and float(parts["tpl"]) > 0
+    assert int(re.search(r"SQL \((\d+) comandos\)", timing).group(1)) > 0
+    assert "Server-Timing" in public.get("/static/script.js").headers
+
+
+def test_profile_token_header(public, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "PROFILER_TOKEN", "segredo")
+    monkeypatch.setattr(app_module, "PROFILER_ENABLED", True)
+    # Token errado com caracteres fora do ASCII: página normal, não erro 500
+    wrong = public.get("/agenda", headers={"X-Profile": "não é o token"})
+    assert wrong.status_code == 200
+    assert wrong.mimetype == "text/html"
+    profiled = public.get("/agenda", headers={"X-Profile": "segredo"})
+    assert profiled.status_code == 200
+    assert profiled.mimetype == "application/zip"
@@ -0,0 +1,55 @@
+import pytest
+
+from backends import translate_sql, normalize_sql
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM users WHERE id=?", "SELECT * FROM users WHERE id=%s"),
+    ("SELECT 1 FROM bookings WHERE barber_id IS ? AND day=?",
+     "SELECT 1 FROM bookings WHERE barber_id IS NOT DISTINCT FROM %s AND day=%s"),
+    ("UPDATE bookings SET status='cancelado' WHERE id=?", "UPDATE bookings SET status='cancelado' WHERE id=%s"),
+    ("SELECT name FROM users WHERE name LIKE 'a%' AND id=?", "SELECT name FROM users WHERE name LIKE 'a%%' AND id=%s"),
+    ("BEGIN IMMEDIATE", "BEGIN"),
+    ("SELECT 1;", "SELECT 1"),
+])
+def test_translate_sql(sql, expected):
+    assert translate_sql(sql)[0] == expected
+
+
+@pytest.mark.parametrize("sql, expected", [
+    # ? e IS ? dentro de literais e comentários ficam como estão
+    ("SELECT id FROM users WHERE username='quem?' AND id=?", "SELECT id FROM users WHERE username='quem?' AND id=%s"),
+    ("SELECT 'IS ?' AS a, x IS ? FROM t", "SELECT 'IS ?' AS a, x IS NOT DISTINCT FROM %s FROM t"),
+    ("SELECT 'it''s ?' FROM t WHERE a=?", "SELECT 'it''s ?' FROM t WHERE a=%s"),
+    ("SELECT \"col?\" FROM t WHERE a=?", "SELECT \"col?\" FROM t WHERE a=%s"),
+    ("SELECT a -- por quê? IS ?\nFROM t WHERE b=?", "SELECT a -- por quê? IS ?\nFROM t WHERE b=%s"),
+    ("SELECT /* a=? IS ? */ a FROM t WHERE b IS ?", "SELECT /* a=? IS ? */ a FROM t WHERE b IS NOT DISTINCT FROM %s"),
+])
+def test_translate_sql_skips_literals_and_comments(sql, expected):
+    assert translate_sql(sql)[0] == expected
+
+
+def test_translate_insert_or_ignore_and_returning():
+    sql, returns_id = translate_sql("INSERT OR IGNORE INTO bookings(day, time) VALUES(?, '?')")
+    assert sql == "INSERT INTO bookings(day, time) VALUES(%s, '?') ON CONFLICT DO NOTHING RETURNING id"
+    assert returns_id
+    sql, returns_id = translate_sql("INSERT INTO booking_services(booking_id) VALUES(?)")
+    assert sql == "INSERT INTO booking_services(booking_id) VALUES(%s)"
+    assert not returns_id
+    assert translate_sql("INSERT INTO users(username) VALUES(?)", want_id=False) == ("INSERT INTO users(username) VALUES(%s)", False)
+
+
+def test_normalize_sql():
+    assert normalize_sql("SELECT *\n  FROM t WHERE a = 'x' AND b = 3 AND c IN (?, ?, ?)") == \
+        "SELECT * FROM t WHERE a = ? AND b = ? AND c IN (?, ...)"
+
+
+def test_literals_and_null_parameters_on_backend(db):
+    # Mesmo comando no SQLite e no PostgreSQL (ver database_url em conftest.py)
+    conn = db.get_conn()
+    row = conn.execute("SELECT 'quem? IS ?' AS texto, ? AS valor -- e agora?", (7,)).fetchone()
+    assert (row["texto"], row["valor"]) == ("quem? IS ?", 7)
+    conn.execute("INSERT INTO barbershops(name, slug, phone) VALUES('Sem telefone', 'sem-telefone', NULL)")
+    conn.commit()
+    row = conn.execute("SELECT slug FROM barbershops WHERE phone IS ? AND name LIKE 'Sem%'", (None,)).fetchone()
+    assert row["slug"] == "sem-telefone"
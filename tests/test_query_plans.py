@@ -0,0 +1,150 @@
+# Planos de execução das consultas de storage.py: cada função é chamada com os
+# comandos SQL registrados e cada comando passa por EXPLAIN QUERY PLAN. Nenhuma
+# consulta pode percorrer uma tabela inteira (SCAN) fora das exceções abaixo.
+import re
+from datetime import datetime
+
+import pytest
+
+import storage
+
+# Consultas que percorrem a tabela de propósito (listagens completas)
+ALLOWED_SCANS = {
+    "get_barbershops",
+    "count_barbershops",
+}
+# Consultas com LIMIT que leem uma única linha mesmo sem índice
+ALLOWED_SQL = {
+    "SELECT id FROM barbershops LIMIT 1",
+    # uma linha por tabela em cache
+    "SELECT name, generation FROM cache_generations",
+}
+
+SKIP_PREFIXES = ("BEGIN", "COMMIT", "ROLLBACK", "PRAGMA", "CREATE", "DROP", "ALTER", "SAVEPOINT", "RELEASE")
+SQL_KEYWORDS = {"WHERE", "JOIN", "LEFT", "INNER", "ON", "GROUP", "ORDER", "LIMIT", "SET", "AND", "WHEN", "UNION"}
+
+# (nome da função, chamada com s=storage e c=ids da barbearia de teste), na
+# ordem em que rodam: as escritas do começo preparam as leituras seguintes
+CALLS = [
+    ("create_admin", lambda s, c: s.create_admin("admin2", "x")),
+    ("get_all_barbershops_with_stats", lambda s, c: s.get_all_barbershops_with_stats(after_name="A", after_id=1, limit=50)),
+    ("count_barbershops", lambda s, c: s.count_barbershops()),
+    ("get_default_barber_id", lambda s, c: s.get_default_barber_id()),
+    ("get_barbershops", lambda s, c: s.get_barbershops()),
+    ("get_barbershop", lambda s, c: s.get_barbershop(c["shop_id"])),
+    ("get_barbershop_by_slug", lambda s, c: s.get_barbershop_by_slug("loja")),
+    ("update_barbershop", lambda s, c: s.update_barbershop(c["shop_id"], "Loja", "loja", "1", None)),
+    ("toggle_barbershop_status", lambda s, c: s.toggle_barbershop_status(c["shop_id"])),
+    ("get_users_by_barbershop", lambda s, c: s.get_users_by_barbershop(c["shop_id"])),
+    ("update_user_profile", lambda s, c: s.update_user_profile(c["barber_id"], barbearia_nome="Loja", phone="1")),
+    ("get_user_by_username", lambda s, c: s.get_user_by_username("barbeiro1")),
+    ("get_user_by_id", lambda s, c: s.get_user_by_id(c["barber_id"])),
+    ("get_principal_by_username", lambda s, c: s.get_principal_by_username("barbeiro1")),
+    ("verify_user", lambda s, c: s.verify_user("barbeiro1", "x")),
+    ("get_week_template", lambda s, c: s.get_week_template(c["barber_id"])),
+    ("get_calendar_version", lambda s, c: s.get_calendar_version(2030, 1, c["barber_id"], c["shop_id"])),
+    ("get_availability", lambda s, c: s.get_availability(10, 2030, 1, c["barber_id"], c["shop_id"])),
+    ("get_month_availability", lambda s, c: s.get_month_availability(2030, 1, c["barber_id"], c["shop_id"])),
+    ("is_slot_taken", lambda s, c: s.is_slot_taken(10, "09:00", 2030, 1, c["barber_id"], c["shop_id"])),
+    ("create_booking", lambda s, c: s.create_booking(c["client_id"], 12, "10:00", year=2030, month=1, barber_id=c["barber_id"], barbershop_id=c["shop_id"])),
+    ("get_bookings_by_user", lambda s, c: s.get_bookings_by_user(c["client_id"])),
+    ("get_bookings_between", lambda s, c: s.get_bookings_between("2029-12-20", "2030-02-10", c["barber_id"], c["shop_id"])),
+    ("get_bookings_between", lambda s, c: s.get_bookings_between(datetime(2030, 1, 10, 8, 30), datetime(2030, 1, 12, 12, 0), c["barber_id"], c["shop_id"])),
+    ("get_bookings_by_day_with_usernames", lambda s, c: s.get_bookings_by_day_with_usernames(10, 2030, 1, c["barber_id"], c["shop_id"])),
+    ("get_bookings_page", lambda s, c: s.get_bookings_page(c["barber_id"], c["shop_id"], after=("2030-01-01", 0, 0))),
+    ("get_bookings_page", lambda s, c: s.get_bookings_page(c["barber_id"], c["shop_id"], before=("2030-01-20", 600, 5))),
+    ("get_all_bookings_with_usernames", lambda s, c: s.get_all_bookings_with_usernames(c["barber_id"], c["shop_id"])),
+    ("get_services_for_barber", lambda s, c: s.get_services_for_barber(c["barber_id"], c["shop_id"])),
+    ("get_services_by_ids", lambda s, c: s.get_services_by_ids([1, 2, 3], c["barber_id"], c["shop_id"])),
+    ("get_booking_services", lambda s, c: s.get_booking_services(1)),
+    ("get_service_by_id", lambda s, c: s.get_service_by_id(1, c["barber_id"], c["shop_id"])),
+    ("update_service", lambda s, c: s.update_service(1, c["barber_id"], c["shop_id"], "Corte", 4000)),
+    ("get_monthly_stats_for_barber", lambda s, c: s.get_monthly_stats_for_barber(c["barber_id"], c["shop_id"])),
+    ("get_horario_by_id", lambda s, c: s.get_horario_by_id(1)),
+    ("update_horario", lambda s, c: s.update_horario(1, "08:00", False)),
+    ("set_slot_active", lambda s, c: s.set_slot_active(1, 1)),
+    ("set_slot_active_at", lambda s, c: s.set_slot_active_at(13, "08:30", 0, 2030, 1, c["barber_id"], c["shop_id"])),
+    ("set_day_active", lambda s, c: s.set_day_active(14, 0, 2030, 1, c["barber_id"], c["shop_id"])),
+    ("restore_day_availability", lambda s, c: s.restore_day_availability(14, 2030, 1, c["barber_id"], c["shop_id"])),
+    ("seed_barbershop", lambda s, c: s.seed_barbershop(c["shop_id"])),
+    ("cancel_booking_by_details", lambda s, c: s.cancel_booking_by_details(12, "10:00", 2030, 1, c["barber_id"], c["shop_id"])),
+    ("cancel_booking", lambda s, c: s.cancel_booking(1, user_id=c["client_id"])),
+    ("cancel_booking", lambda s, c: s.cancel_booking(1, barber_id=c["barber_id"])),
+    ("get_or_create_public_client", lambda s, c: s.get_or_create_public_client()),
+    ("delete_service", lambda s, c: s.delete_service(1, c["barber_id"], c["shop_id"])),
+    ("delete_barbershop", lambda s, c: s.delete_barbershop(c["shop_id"])),
+]
+
+
+def _seed():
+    conn = storage.get_conn()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO barbershops(name, slug, phone) VALUES('Loja', 'loja', '1')")
+    shop_id = cur.lastrowid
+    conn.commit()
+    barber_id = storage.create_user("barbeiro1", "x", role="barbeiro", barbershop_id=shop_id)
+    client_id = storage.create_user("cliente1", "x", role="cliente", barbershop_id=shop_id)
+    storage.create_service(barber_id, shop_id, "Corte", 3500)
+    storage.create_booking(client_id, 10, "09:00", year=2030, month=1, barber_id=barber_id, barbershop_id=shop_id, price_cents=3500)
+    storage.set_slot_active_at(11, "08:00", 0, 2030, 1, barber_id=barber_id, barbershop_id=shop_id)
+    return {"shop_id": shop_id, "barber_id": barber_id, "client_id": client_id}
+
+
+def _scans(conn, sql, tables):
+    # Só conta SCAN de tabelas reais (ou apelidos delas); CTEs e subconsultas
+    # materializadas já são limitadas pela consulta que as gera.
+    aliases = {}
+    for table, alias in re.findall(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", sql, re.I):
+        if table in tables:
+            aliases[table] = table
+            if alias and alias.upper() not in SQL_KEYWORDS:
+                aliases[alias] = table
+    details = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()]
+    return [d for d in details if (m := re.match(r"SCAN (\w+)", d)) and m.group(1) in aliases]
+
+
+@pytest.fixture(scope="module")
+def plans(tmp_path_factory):
+    # {função: [(sql, linhas SCAN do plano)]} de todas as chamadas de CALLS
+    mp = pytest.MonkeyPatch()
+    mp.setenv("DATABASE_URL", "sqlite:///" + str(tmp_path_factory.mktemp("plans") / "plans.db"))
+    # O cache de leitura esconderia as consultas repetidas
+    mp.setattr(storage, "STORAGE_CACHE_SIZE", 0)
+    storage.close_conn()
+    storage.init_db()
+    ids = _seed()
+    conn = storage.get_conn()
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    result = {}
+    for name, call in CALLS:
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            call(storage, ids)
+        finally:
+            conn.set_trace_callback(None)
+        checked = result.setdefault(name, [])
+        # Triggers de linha fazem o mesmo comando aparecer uma vez por linha afetada
+        for sql in dict.fromkeys(statements):
+            normalized = " ".join(sql.split())
+            if normalized.upper().startswith(SKIP_PREFIXES) or normalized in ALLOWED_SQL:
+                continue
+            if normalized.upper().startswith("INSERT") and "SELECT" not in normalized.upper():
+                continue
+            checked.append((normalized, _scans(conn, sql, tables)))
+    yield result
+    storage.close_conn()
+    mp.undo()
+
+
+@pytest.mark.parametrize("name", list(dict.fromkeys(name for name, _ in CALLS)))
+def test_no_table_scan(plans, name):
+    if name in ALLOWED_SCANS:
+        pytest.skip("percorre a tabela de propósito")
+    scans = [(sql, bad) for sql, bad in plans[name] if bad]
+    assert not scans, "\n".join(f"{sql}\n    {bad}" for sql, bad in scans)
+
+
+def test_queries_were_checked(plans):
+    # Protege contra o trace deixar de registrar comandos
+    assert sum(len(v) for v in plans.values()) > 50
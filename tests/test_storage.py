@@ -0,0 +1,246 @@
+import threading
+import time
+from datetime import date, datetime
+
+import pytest
+
+import storage
+
+
+def _book(db, shop, day, time, **kwargs):
+    kwargs.setdefault("year", 2030)
+    kwargs.setdefault("month", 1)
+    kwargs.setdefault("barber_id", shop["barber_id"])
+    kwargs.setdefault("barbershop_id", shop["shop_id"])
+    return db.create_booking(shop["client_id"], day, time, **kwargs)
+
+
+def _booking_id(db, day, time, month=1):
+    conn = db.get_conn()
+    row = conn.execute(
+        "SELECT id FROM bookings WHERE year=2030 AND month=? AND day=? AND time=? AND status='confirmado'",
+        (month, day, time),
+    ).fetchone()
+    return row["id"]
+
+
+# === Conflitos de reserva ===
+
+def test_same_slot_is_booked_only_once(db, shop):
+    assert _book(db, shop, 10, "09:00") is True
+    assert _book(db, shop, 10, "09:00") is False
+    assert db.is_slot_taken(10, "09:00", 2030, 1, shop["barber_id"], shop["shop_id"])
+    conn = db.get_conn()
+    assert conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0] == 1
+
+
+def test_other_barber_or_time_is_not_a_conflict(db, shop):
+    other = db.create_user("barbeiro2", "x", role="barbeiro", barbershop_id=shop["shop_id"])
+    assert _book(db, shop, 10, "09:00") is True
+    assert _book(db, shop, 10, "09:00", barber_id=other) is True
+    assert _book(db, shop, 10, "09:30") is True
+    assert _book(db, shop, 11, "09:00") is True
+
+
+def test_cancelled_slot_can_be_booked_again(db, shop):
+    assert _book(db, shop, 10, "09:00") is True
+    booking_id = _booking_id(db, 10, "09:00")
+    assert db.cancel_booking(booking_id, user_id=shop["client_id"]) is True
+    assert not db.is_slot_taken(10, "09:00", 2030, 1, shop["barber_id"], shop["shop_id"])
+    assert _book(db, shop, 10, "09:00") is True
+
+
+def test_cancel_checks_the_owner(db, shop):
+    other_client = db.create_user("cliente2", "x", role="cliente", barbershop_id=shop["shop_id"])
+    _book(db, shop, 10, "09:00")
+    booking_id = _booking_id(db, 10, "09:00")
+    assert db.cancel_booking(booking_id, user_id=other_client) is False
+    assert db.cancel_booking(booking_id, barber_id=shop["barber_id"]) is True
+    assert db.cancel_booking(booking_id, barber_id=shop["barber_id"]) is False
+
+
+def test_cancel_by_details_stays_in_the_barber_shop(db, shop):
+    conn = db.get_conn()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO barbershops(name, slug, phone) VALUES('Loja Dois', 'loja-dois', '1190001')")
+    other_shop = cur.lastrowid
+    conn.commit()
+    other_barber = db.create_user("barbeiro2", "x", role="barbeiro", barbershop_id=other_shop)
+    _book(db, shop, 10, "09:00")
+    assert db.cancel_booking_by_details(10, "09:00", 2030, 1, other_barber, other_shop) is False
+    assert db.is_slot_taken(10, "09:00", 2030, 1, shop["barber_id"], shop["shop_id"])
+    assert db.cancel_booking_by_details(10, "09:00", 2030, 1, shop["barber_id"], shop["shop_id"]) is True
+    assert not db.is_slot_taken(10, "09:00", 2030, 1, shop["barber_id"], shop["shop_id"])
+
+
+def test_booked_slot_is_unavailable(db, shop):
+    _book(db, shop, 10, "09:00")
+    slots = {s["time"]: s for s in db.get_availability(10, 2030, 1, shop["barber_id"], shop["shop_id"])}
+    assert slots["09:00"]["is_taken"] and not slots["09:00"]["available"]
+    assert slots["09:30"]["available"]
+
+
+def test_bookings_between_crosses_months(db, shop):
+    for month, day, t in [(1, 30, "18:00"), (1, 31, "08:00"), (2, 1, "09:00"), (2, 1, "17:30"), (2, 2, "08:00"), (3, 1, "08:00")]:
+        _book(db, shop, day, t, month=month)
+    other = db.create_user("barbeiro2", "x", role="barbeiro", barbershop_id=shop["shop_id"])
+    _book(db, shop, 1, "10:00", month=2, barber_id=other)
+
+    rows = db.get_bookings_between(date(2030, 1, 31), "2030-02-01", shop["barber_id"], shop["shop_id"])
+    assert [(r["month"], r["day"], r["time"]) for r in rows] == [(1, 31, "08:00"), (2, 1, "09:00"), (2, 1, "17:30")]
+
+    # Com datetime o intervalo vale até o minuto, nas duas pontas
+    rows = db.get_bookings_between(datetime(2030, 1, 30, 18, 0), datetime(2030, 2, 1, 17, 0), shop["barber_id"], shop["shop_id"])
+    assert [r["date_iso"] + " " + r["time"] for r in rows] == ["2030-01-30 18:00", "2030-01-31 08:00", "2030-02-01 09:00"]
+
+# === Transações ===
+
+def test_write_refuses_pending_transaction(db, shop):
+    conn = db.get_conn()
+    conn.execute("UPDATE barbershops SET phone='2' WHERE id=?", (shop["shop_id"],))
+    assert conn.in_transaction
+    with pytest.raises(RuntimeError):
+        _book(db, shop, 10, "09:00")
+    # A escrita pendente foi desfeita, não confirmada
+    assert db.get_conn().execute("SELECT phone FROM barbershops WHERE id=?", (shop["shop_id"],)).fetchone()[0] == "1190000"
+
+
+# === Totais mensais mantidos por triggers ===
+
+def _stats(db, shop):
+    return [dict(r) for r in db.get_monthly_stats_for_barber(shop["barber_id"], shop["shop_id"])]
+
+
+def test_monthly_stats_follow_bookings(db, shop):
+    _book(db, shop, 10, "09:00", price_cents=3000)
+    _book(db, shop, 11, "09:00", price_cents=2500)
+    _book(db, shop, 5, "09:00", month=2, price_cents=4000)
+    assert _stats(db, shop) == [
+        {"year": 2030, "month": 2, "total_cortes": 1, "total_revenue": 4000},
+        {"year": 2030, "month": 1, "total_cortes": 2, "total_revenue": 5500},
+    ]
+
+    db.cancel_booking(_booking_id(db, 10, "09:00"), user_id=shop["client_id"])
+    db.cancel_booking(_booking_id(db, 5, "09:00", month=2), user_id=shop["client_id"])
+    assert _stats(db, shop) == [{"year": 2030, "month": 1, "total_cortes": 1, "total_revenue": 2500}]
+
+
+def test_monthly_stats_follow_updates_and_deletes(db, shop):
+    _book(db, shop, 10, "09:00", price_cents=3000)
+    booking_id = _booking_id(db, 10, "09:00")
+    conn = db.get_conn()
+    conn.execute("UPDATE bookings SET price_cents=3500, month=3 WHERE id=?", (booking_id,))
+    conn.commit()
+    assert _stats(db, shop) == [{"year": 2030, "month": 3, "total_cortes": 1, "total_revenue": 3500}]
+    conn.execute("DELETE FROM bookings WHERE id=?", (booking_id,))
+    conn.commit()
+    assert _stats(db, shop) == []
+
+
+def test_rebuild_matches_triggers(db, shop):
+    for day in range(1, 6):
+        _book(db, shop, day, "10:00", price_cents=1000 * day)
+    before = _stats(db, shop)
+    db.rebuild_monthly_stats()
+    assert _stats(db, shop) == before == [{"year": 2030, "month": 1, "total_cortes": 5, "total_revenue": 15000}]
+
+
+def test_calendar_version_changes_on_writes(db, shop):
+    args = (2030, 1, shop["barber_id"], shop["shop_id"])
+    v0 = db.get_calendar_version(*args)
+    _book(db, shop, 10, "09:00")
+    v1 = db.get_calendar_version(*args)
+    assert v1[0] > v0[0]
+    db.set_slot_active_at(11, "08:00", 0, 2030, 1, shop["barber_id"], shop["shop_id"])
+    v2 = db.get_calendar_version(*args)
+    assert v2[0] > v1[0]
+    # Outro mês não muda
+    assert db.get_calendar_version(2030, 2, shop["barber_id"], shop["shop_id"])[0] == 0
+
+# === Paginação por keyset ===
+
+def _key(r):
+    return (r["date_iso"], r["minute_of_day"], r["id"])
+
+
+def test_keyset_pages_cover_every_booking_once(db, shop):
+    times = ["08:00", "09:30", "14:00"]
+    for month in (1, 2):
+        for day in (3, 1, 28):
+            for t in times:
+                _book(db, shop, day, t, month=month)
+    # Um cancelado não aparece
+    db.cancel_booking(_booking_id(db, 28, "14:00", month=2), user_id=shop["client_id"])
+
+    seen = []
+    after = None
+    while True:
+        page = db.get_bookings_page(shop["barber_id"], shop["shop_id"], after=after, limit=4)
+        if not page:
+            break
+        seen.extend(page)
+        after = _key(page[-1])
+
+    keys = [_key(r) for r in seen]
+    assert len(keys) == 17 == len(set(keys))
+    assert keys == sorted(keys)
+    assert keys[0][:2] == ("2030-01-01", 480)
+    assert [(r["month"], r["day"], r["time"]) for r in seen[-2:]] == [(2, 28, "08:00"), (2, 28, "09:30")]
+
+    # before volta pelo mesmo caminho, em ordem decrescente
+    older = db.get_bookings_page(shop["barber_id"], shop["shop_id"], before=keys[5], limit=3)
+    assert [_key(r) for r in older] == keys[2:5][::-1]
+
+
+def test_keyset_page_is_scoped_to_barber(db, shop):
+    other = db.create_user("barbeiro2", "x", role="barbeiro", barbershop_id=shop["shop_id"])
+    _book(db, shop, 10, "09:00")
+    _book(db, shop, 10, "09:00", barber_id=other)
+    rows = db.get_bookings_page(shop["barber_id"], shop["shop_id"])
+    assert len(rows) == 1
+
+
+# === Hash de senha ===
+
+def test_password_hashes_are_capped_per_process(monkeypatch):
+    monkeypatch.setattr(storage, "PASSWORD_HASH_CONCURRENCY", 3)
+    monkeypatch.setattr(storage, "_hash_slots_pid", None)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def slow_hash(*args):
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+        return "hash"
+
+    monkeypatch.setattr(storage, "generate_password_hash", slow_hash)
+    monkeypatch.setattr(storage, "check_password_hash", slow_hash)
+    threads = [threading.Thread(target=storage.hash_password, args=("x",)) for _ in range(8)]
+    threads += [threading.Thread(target=storage.check_password, args=("h", "x")) for _ in range(8)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    assert len(peak) == 16
+    assert max(peak) == 3
+
+
+# === Cache ===
+
+def test_barbershop_count_is_cached_until_barbershops_change(db, shop):
+    total = db.count_barbershops()
+    hits = db.cache_stats()["hits"]
+    assert db.count_barbershops() == total
+    assert db.cache_stats()["hits"] == hits + 1
+    # Cadastro feito direto na conexão, como em app.register_barber
+    conn = db.get_conn()
+    conn.execute("INSERT INTO barbershops(name, slug, phone) VALUES('Loja Dois', 'loja-dois', '1190001')")
+    conn.commit()
+    assert db.count_barbershops() == total + 1
+    db.delete_barbershop(shop["shop_id"])
+    assert db.count_barbershops() == total